@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+DEFAULT_CACHE_PATH = ".cache/embeddings.sqlite"
+
+
+def text_key(text: str) -> bytes:
+    """Short content hash used to dedupe texts and key the cache."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+
+class EmbeddingCache:
+    """
+    sqlite-backed vector store keyed by (model_name, blake2b(text)),
+    so re-runs over unchanged transcripts skip embedding entirely.
+    Vectors are stored as float32, so a cache hit returns exactly the vector a miss would have
+    produced (and indexed) for the same text.
+    Safe to share between threads (react_rag_demo.py embeds from worker threads).
+    """
+
+    def __init__(self, path: str, model_name: str):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.model_name = model_name
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings_f32 ("
+            " model TEXT NOT NULL, key BLOB NOT NULL, vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, key))"
+        )
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, List[float]]:
+        keys = list(keys)
+        found: Dict[bytes, List[float]] = {}
+        # stay well under sqlite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            part = keys[i : i + 500]
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT key, vec FROM embeddings_f32 WHERE model = ? AND key IN ({','.join('?' * len(part))})",
+                    [self.model_name, *part],
+                ).fetchall()
+            for k, blob in rows:
+                found[k] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, List[float]]]) -> None:
+        rows = [(self.model_name, k, np.asarray(v, dtype=np.float32).tobytes()) for k, v in items]
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings_f32 (model, key, vec) VALUES (?, ?, ?)", rows)
+            self.conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+def embed_with_cache(
+    texts: List[str],
+    embed_fn: Callable[[List[str]], List[List[float]]],
+    cache: Optional[EmbeddingCache] = None,
+) -> List[List[float]]:
+    """
+    Embed only unique, uncached texts and scatter the vectors back to every input position.
+    embed_fn is only called when there is something left to embed.
+    """
+    keys = [text_key(t) for t in texts]
+    unique: Dict[bytes, str] = {}
+    for k, t in zip(keys, texts):
+        unique.setdefault(k, t)
+
+    vec_by_key = cache.get_many(unique) if cache is not None else {}
+    missing = [k for k in unique if k not in vec_by_key]
+
+    if missing:
+        fresh = embed_fn([unique[k] for k in missing])
+        new_items = list(zip(missing, fresh))
+        vec_by_key.update(new_items)
+        if cache is not None:
+            cache.put_many(new_items)
+
+    return [vec_by_key[k] for k in keys]
@@ -1,84 +1,256 @@
 from __future__ import annotations
 
+import argparse
+import itertools
+import multiprocessing
 import random
 import uuid
 from dataclasses import dataclass
-from typing import Dict, Any, List, Tuple
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
+import numpy as np
 import yaml
 
+# libyaml-backed loader/dumper when available (much faster on large files)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+Dist = Tuple[Tuple[str, ...], List[float], float]
+
+
+def _prepare_dist(weights: Dict[str, float]) -> Dist:
+    """Precompute (keys, cumulative weights, total) for repeated sampling."""
+    keys = tuple(weights)
+    cum = list(itertools.accumulate(weights[k] for k in keys))
+    return keys, cum, cum[-1]
+
+
+def _draw_labels(nrng: np.random.Generator, dist: Dist, size: int) -> List[str]:
+    """`size` weighted draws from a prepared distribution in one numpy call."""
+    keys, cum, total = dist
+    idx = np.searchsorted(cum, nrng.random(size) * total, side="left")
+    return [keys[i] for i in idx.tolist()]
+
+
+def _draw_indices(nrng: np.random.Generator, pool_sizes: List[int]) -> List[int]:
+    """One uniform index per pool, drawn in a single numpy call."""
+    return (nrng.random(len(pool_sizes)) * np.asarray(pool_sizes)).astype(np.int64).tolist()
+
+
+_TONE_PREFIXES: Dict[str, Tuple[str, ...]] = {
+    "warm": (
+        "Thanks for calling — ",
+        "No problem at all — ",
+        "Of course — ",
+    ),
+    "neutral": (
+        "",
+        "Okay — ",
+        "Right — ",
+    ),
+    "formal": (
+        "Thank you for contacting HSBC — ",
+        "Certainly — ",
+        "I appreciate that — ",
+    ),
+}
+
+# short inserts to add realism / intensity without bloating
+_TEMPERAMENT_MODS: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "calm": {
+        "customer": ("", "Just checking, ", "If you don’t mind, "),
+        "agent": ("", ""),
+    },
+    "frustrated": {
+        "customer": ("Honestly, ", "This is really frustrating — ", "I’ve tried twice now, "),
+        "agent": ("I’m sorry about that. ", "I understand. ", ""),
+    },
+    "angry": {
+        "customer": ("This is unacceptable — ", "I’m really angry about this — ", "I’ve had enough — "),
+        "agent": ("I’m very sorry. ", "I understand how serious this is. ", ""),
+    },
+}
+
+# Customer responses, keyed by sentiment (anything else is treated as negative)
+_POSITIVE = (
+    "Okay, that makes sense.",
+    "Thanks, that helps.",
+    "Great — I appreciate it.",
+)
+_NEUTRAL = (
+    "Alright.",
+    "Okay, I guess.",
+    "Fine, what do I do next?",
+)
+_NEGATIVE = (
+    "That’s not good enough.",
+    "Why wasn’t this clearer?",
+    "I’m not happy about this.",
+    "This is causing me real hassle.",
+)
+_RESPONSES: Dict[str, Tuple[str, ...]] = {
+    "positive": _POSITIVE,
+    "neutral": _NEUTRAL,
+    "negative": _NEGATIVE,
+}
+
+_CLOSING_AGENT_LINES: Dict[str, Tuple[str, ...]] = {
+    "resolved": (
+        "I’m glad we could sort that today. Is there anything else I can help with?",
+        "That should be all set now. Thanks for your patience.",
+    ),
+    "partial": (
+        "I’ve done what I can from here. If it persists, please call back and quote this reference.",
+        "I’ve logged this and the team will continue investigating.",
+    ),
+    "escalated": (
+        "I’m escalating this now and you’ll receive an update as soon as possible.",
+        "I’m raising this to the relevant team and arranging a follow-up.",
+    ),
+    "unresolved": (
+        "I’m sorry we couldn’t resolve this on the call today.",
+        "I understand your frustration — I don’t have a fix available right now.",
+    ),
+}
+
+
+_PAD_AGENT = "Just to confirm, did you want me to note anything else on your account?"
+_PAD_CUST = "No, that’s all."
+
+
+def _check_builtin_text() -> None:
+    """
+    build_turns concatenates prefix/modifier + line without a final .strip(); that is only
+    equivalent when prefixes never start with whitespace and lines are already trimmed.
+    Explicit checks rather than asserts, so they still run under python -O.
+    """
+    prefixes = [
+        *itertools.chain.from_iterable(_TONE_PREFIXES.values()),
+        *(m for mods in _TEMPERAMENT_MODS.values() for ms in mods.values() for m in ms),
+    ]
+    for prefix in prefixes:
+        if prefix != prefix.lstrip():
+            raise ValueError(f"Tone/temperament prefix starts with whitespace: {prefix!r}")
+    for line in itertools.chain(*_RESPONSES.values(), *_CLOSING_AGENT_LINES.values()):
+        if not line or line != line.strip():
+            raise ValueError(f"Built-in response/closing line is empty or untrimmed: {line!r}")
 
-def weighted_choice(rng: random.Random, weights: Dict[str, float]) -> str:
-    """Return key sampled by weights."""
-    items = list(weights.items())
-    total = sum(w for _, w in items)
-    r = rng.random() * total
-    upto = 0.0
-    for k, w in items:
-        upto += w
-        if upto >= r:
-            return k
-    return items[-1][0]
-
-
-def choose_turn_count(rng: random.Random, spec: Dict[str, Any]) -> int:
-    dist = spec["generation"]["call_length"]["distribution"]
-    band = weighted_choice(rng, dist)
-    if band == "short":
-        lo, hi = spec["generation"]["call_length"]["short_turns"]
-    elif band == "medium":
-        lo, hi = spec["generation"]["call_length"]["medium_turns"]
-    else:
-        lo, hi = spec["generation"]["call_length"]["long_turns"]
-    return rng.randint(lo, hi)
 
+_check_builtin_text()
 
-def pick_journey_type(rng: random.Random, event_id: str, spec: Dict[str, Any]) -> str:
-    mix = spec["event_journey_mix"][event_id]
-    return weighted_choice(rng, mix)
 
+def check_scenario_text(spec: Dict[str, Any]) -> None:
+    """
+    Fail fast on scenario lines with leading/trailing whitespace, which build_turns
+    would otherwise copy verbatim into the transcript (it no longer strips each turn).
+    """
+    for journey_type, scenarios in spec["scenario_library"].items():
+        for scenario in scenarios:
+            lines = [*scenario["agent_moves"], *itertools.chain.from_iterable(scenario["closings"].values())]
+            for line in lines:
+                if not line or line != line.strip():
+                    raise ValueError(
+                        f"Scenario {scenario.get('scenario_id', '?')} ({journey_type}) has an empty "
+                        f"or untrimmed line: {line!r}"
+                    )
 
-def pick_scenario(rng: random.Random, journey_type: str, spec: Dict[str, Any]) -> Dict[str, Any]:
-    options = spec["scenario_library"][journey_type]
-    return rng.choice(options)
 
+TurnBuilder = Callable[[random.Random, Dict[str, Any], str, int, Dict[str, str], Optional[int]], List[Dict[str, str]]]
 
-def tone_prefixes() -> Dict[str, List[str]]:
-    return {
-        "warm": [
-            "Thanks for calling — ",
-            "No problem at all — ",
-            "Of course — ",
-        ],
-        "neutral": [
-            "",
-            "Okay — ",
-            "Right — ",
-        ],
-        "formal": [
-            "Thank you for contacting HSBC — ",
-            "Certainly — ",
-            "I appreciate that — ",
-        ],
-    }
 
+def _make_builder(sentiment: str, agent_tone: str, customer_temperament: str) -> TurnBuilder:
+    """
+    Return a turn builder specialised for one (sentiment, agent_tone, customer_temperament).
+    The tone prefix, modifier and response tuples are resolved here and closed over,
+    so the per-turn loop does no table lookups or sentiment branching.
+    """
+    tone_pref = _TONE_PREFIXES[agent_tone]
+    cust_mods = _TEMPERAMENT_MODS[customer_temperament]["customer"]
+    agent_mods = _TEMPERAMENT_MODS[customer_temperament]["agent"]
+    responses = _RESPONSES.get(sentiment, _NEGATIVE)
+
+    def _build(
+        rng: random.Random,
+        scenario: Dict[str, Any],
+        outcome: str,
+        target_turns: int,
+        speakers: Dict[str, str],
+        opening_idx: Optional[int] = None,
+    ) -> List[Dict[str, str]]:
+        choice = rng.choice
+        turns: List[Dict[str, str]] = []
+        append = turns.append
+
+        cust_name = speakers["customer"]
+        agent_name = speakers["agent"]
+
+        if opening_idx is None:
+            opening = choice(scenario["opening"])
+        else:
+            opening = scenario["opening"][opening_idx]
+        opening = choice(cust_mods) + opening
+        append({"speaker": cust_name, "text": opening})
+
+        # Agent acknowledges + first move
+        moves = list(scenario["agent_moves"])
+        rng.shuffle(moves)
+
+        # We’ll generate a back-and-forth until we’re close to target_turns
+        # Each "move" typically adds 2 turns (agent + customer).
+        move_i = 0
+        while len(turns) < target_turns - 2 and move_i < len(moves):
+            move = moves[move_i]
+            move_i += 1
+
+            agent_line = choice(tone_pref) + move
+            agent_line = choice(agent_mods) + agent_line
+            append({"speaker": agent_name, "text": agent_line})
+
+            # Customer response: vary by sentiment/temperament
+            cust_line = choice(cust_mods) + choice(responses)
+            append({"speaker": cust_name, "text": cust_line})
+
+        # Agent closing + Customer closing
+        agent_close = choice(_CLOSING_AGENT_LINES[outcome])
+        agent_close = choice(tone_pref) + agent_close
+        append({"speaker": agent_name, "text": agent_close})
+
+        customer_close = choice(scenario["closings"][outcome])
+        # Add a small modifier occasionally
+        if rng.random() < 0.35:
+            customer_close = choice(cust_mods) + customer_close
+        append({"speaker": cust_name, "text": customer_close})
+
+        # If we overshot target_turns slightly, trim safely (keep last 2 turns)
+        if len(turns) > target_turns:
+            del turns[target_turns - 2 : -2]
+
+        # If we undershot, pad with brief clarifying exchanges before the closing pair
+        pad_needed = target_turns - len(turns)
+        if pad_needed > 0:
+            tail = turns[-2:]
+            del turns[-2:]
+            pad_pair = ((agent_name, _PAD_AGENT), (cust_name, _PAD_CUST))
+            # Fresh dicts per turn: shared instances would be dumped as YAML anchors/aliases
+            turns.extend(
+                {"speaker": spk, "text": txt}
+                for spk, txt in (pad_pair * ((pad_needed + 1) // 2))[:pad_needed]
+            )
+            turns.extend(tail)
 
-def temperament_modifiers() -> Dict[str, Dict[str, List[str]]]:
-    # short inserts to add realism / intensity without bloating
-    return {
-        "calm": {
-            "customer": ["", "Just checking, ", "If you don’t mind, "],
-            "agent": ["", ""],
-        },
-        "frustrated": {
-            "customer": ["Honestly, ", "This is really frustrating — ", "I’ve tried twice now, "],
-            "agent": ["I’m sorry about that. ", "I understand. ", ""],
-        },
-        "angry": {
-            "customer": ["This is unacceptable — ", "I’m really angry about this — ", "I’ve had enough — "],
-            "agent": ["I’m very sorry. ", "I understand how serious this is. ", ""],
-        },
-    }
+        return turns
+
+    return _build
+
+
+# One specialised builder per known (sentiment, agent_tone, customer_temperament)
+_SPECIALIZED: Dict[Tuple[str, str, str], TurnBuilder] = {
+    (s, t, te): _make_builder(s, t, te)
+    for s in _RESPONSES
+    for t in _TONE_PREFIXES
+    for te in _TEMPERAMENT_MODS
+}
 
 
 def build_turns(
@@ -90,195 +262,174 @@ def build_turns(
     customer_temperament: str,
     target_turns: int,
     speakers: Dict[str, str],
+    opening_idx: int | None = None,
 ) -> List[Dict[str, str]]:
     """
     Expand a scenario skeleton to a turn list.
+    opening_idx selects a pre-drawn opening line; otherwise one is drawn from rng.
     Structure:
       - customer opening
       - 2–4 agent moves + customer responses interleaved
       - closing based on outcome
     """
-    turns: List[Dict[str, str]] = []
-
-    cust_name = speakers["customer"]
-    agent_name = speakers["agent"]
-
-    tone_pref = tone_prefixes()[agent_tone]
-    mods = temperament_modifiers()[customer_temperament]
-
-    opening = rng.choice(scenario["opening"])
-    opening = mods["customer"][rng.randrange(len(mods["customer"]))] + opening
-    turns.append({"speaker": cust_name, "text": opening})
-
-    # Agent acknowledges + first move
-    moves = list(scenario["agent_moves"])
-    rng.shuffle(moves)
-
-    # We’ll generate a back-and-forth until we’re close to target_turns
-    # Each "move" typically adds 2 turns (agent + customer).
-    move_i = 0
-    while len(turns) < target_turns - 2 and move_i < len(moves):
-        move = moves[move_i]
-        move_i += 1
-
-        agent_line = rng.choice(tone_pref) + move
-        agent_line = mods["agent"][rng.randrange(len(mods["agent"]))] + agent_line
-        turns.append({"speaker": agent_name, "text": agent_line.strip()})
-
-        # Customer response: vary by sentiment/temperament
-        if sentiment == "positive":
-            responses = [
-                "Okay, that makes sense.",
-                "Thanks, that helps.",
-                "Great — I appreciate it.",
-            ]
-        elif sentiment == "neutral":
-            responses = [
-                "Alright.",
-                "Okay, I guess.",
-                "Fine, what do I do next?",
-            ]
-        else:  # negative
-            responses = [
-                "That’s not good enough.",
-                "Why wasn’t this clearer?",
-                "I’m not happy about this.",
-                "This is causing me real hassle.",
-            ]
-        cust_line = mods["customer"][rng.randrange(len(mods["customer"]))] + rng.choice(responses)
-        turns.append({"speaker": cust_name, "text": cust_line.strip()})
-
-    # Agent closing + Customer closing
-    closing_agent_lines = {
-        "resolved": [
-            "I’m glad we could sort that today. Is there anything else I can help with?",
-            "That should be all set now. Thanks for your patience.",
-        ],
-        "partial": [
-            "I’ve done what I can from here. If it persists, please call back and quote this reference.",
-            "I’ve logged this and the team will continue investigating.",
-        ],
-        "escalated": [
-            "I’m escalating this now and you’ll receive an update as soon as possible.",
-            "I’m raising this to the relevant team and arranging a follow-up.",
-        ],
-        "unresolved": [
-            "I’m sorry we couldn’t resolve this on the call today.",
-            "I understand your frustration — I don’t have a fix available right now.",
-        ],
-    }
-
-    agent_close = rng.choice(closing_agent_lines[outcome])
-    agent_close = rng.choice(tone_pref) + agent_close
-    turns.append({"speaker": agent_name, "text": agent_close.strip()})
-
-    customer_close = rng.choice(scenario["closings"][outcome])
-    # Add a small modifier occasionally
-    if rng.random() < 0.35:
-        customer_close = mods["customer"][rng.randrange(len(mods["customer"]))] + customer_close
-    turns.append({"speaker": cust_name, "text": customer_close.strip()})
-
-    # If we overshot target_turns slightly, trim safely (keep last 2 turns)
-    if len(turns) > target_turns:
-        keep_tail = turns[-2:]
-        turns = turns[: target_turns - 2] + keep_tail
-
-    # If we undershot, pad with a brief clarifying exchange
-    while len(turns) < target_turns:
-        turns.insert(-2, {"speaker": agent_name, "text": "Just to confirm, did you want me to note anything else on your account?"})
-        turns.insert(-2, {"speaker": cust_name, "text": "No, that’s all."})
-
-        # If we went over after inserting, trim again
-        if len(turns) > target_turns:
-            keep_tail = turns[-2:]
-            turns = turns[: target_turns - 2] + keep_tail
-
-    return turns
+    builder = _SPECIALIZED.get((sentiment, agent_tone, customer_temperament))
+    if builder is None:
+        # e.g. a sentiment outside the table, which is treated as negative
+        builder = _make_builder(sentiment, agent_tone, customer_temperament)
+    return builder(rng, scenario, outcome, target_turns, speakers, opening_idx)
 
 
-def generate_transcripts(spec: Dict[str, Any]) -> Dict[str, Any]:
-    rng = random.Random(spec["generation"]["seed"])
+def _generate_for_event(event: Dict[str, Any], spec: Dict[str, Any], seed: int) -> List[Dict[str, Any]]:
+    """
+    Generate all transcripts for one event. Each event gets its own RNG streams derived from
+    (seed, event_id), so events are independent and the output does not depend on worker count.
+    """
+    event_id = event["event_id"]
+    event_name = event["event_name"]
+    channel = spec["meta"].get("default_channel", "phone")
+
+    # str seeds are hashed with SHA-512 by random.Random, so this is stable across processes
+    rng = random.Random(f"{seed}:{event_id}")
+    # Per-transcript labels are batch-drawn with numpy; rng only drives turn wording
+    nrng = np.random.default_rng(rng.getrandbits(64))
     n_per_event = int(spec["generation"]["transcripts_per_event"])
 
     speakers = spec["meta"]["speakers"]
 
-    sentiments_dist = spec["generation"]["sentiments"]["distribution"]
-    outcomes_dist = spec["generation"]["outcomes"]["distribution"]
-    tone_dist = spec["generation"]["agent_tone"]["distribution"]
-    temp_dist = spec["generation"]["customer_temperament"]["distribution"]
+    # Prepare every distribution once; sampling is then a single searchsorted per label column
+    sentiments_dist = _prepare_dist(spec["generation"]["sentiments"]["distribution"])
+    outcomes_dist = _prepare_dist(spec["generation"]["outcomes"]["distribution"])
+    tone_dist = _prepare_dist(spec["generation"]["agent_tone"]["distribution"])
+    temp_dist = _prepare_dist(spec["generation"]["customer_temperament"]["distribution"])
+    length_dist = _prepare_dist(spec["generation"]["call_length"]["distribution"])
+    journey_dist = _prepare_dist(spec["event_journey_mix"][event_id])
+
+    call_length = spec["generation"]["call_length"]
+    turn_bounds = {
+        "short": call_length["short_turns"],
+        "medium": call_length["medium_turns"],
+    }
+    scenario_library = spec["scenario_library"]
+
+    journey_types = _draw_labels(nrng, journey_dist, n_per_event)
+    scenario_idx = _draw_indices(nrng, [len(scenario_library[jt]) for jt in journey_types])
+    sentiments = _draw_labels(nrng, sentiments_dist, n_per_event)
+    outcomes = _draw_labels(nrng, outcomes_dist, n_per_event)
+    agent_tones = _draw_labels(nrng, tone_dist, n_per_event)
+    temperaments = _draw_labels(nrng, temp_dist, n_per_event)
+    bands = _draw_labels(nrng, length_dist, n_per_event)
+    scenarios = [scenario_library[jt][j] for jt, j in zip(journey_types, scenario_idx)]
+    opening_idx = _draw_indices(nrng, [len(sc["opening"]) for sc in scenarios])
 
     transcripts: List[Dict[str, Any]] = []
+    for n in range(n_per_event):
+        journey_type = journey_types[n]
+        scenario = scenarios[n]
+
+        sentiment = sentiments[n]
+        outcome = outcomes[n]
+        agent_tone = agent_tones[n]
+        customer_temperament = temperaments[n]
+
+        lo, hi = turn_bounds.get(bands[n], call_length["long_turns"])
+        target_turns = rng.randint(lo, hi)
+
+        turns = build_turns(
+            rng=rng,
+            scenario=scenario,
+            sentiment=sentiment,
+            outcome=outcome,
+            agent_tone=agent_tone,
+            customer_temperament=customer_temperament,
+            target_turns=target_turns,
+            speakers=speakers,
+            opening_idx=opening_idx[n],
+        )
+
+        transcript = {
+            "transcript_id": f"{event_id}-T{n + 1:03d}",
+            "event_id": event_id,
+            "event_name": event_name,
+            "channel": channel,
+            "scenario_id": scenario["scenario_id"],
+            "journey_type": journey_type,
+            "sentiment": sentiment,
+            "outcome": outcome,
+            "turns": turns,
+            # optional debug/analysis fields (handy for evaluation)
+            "style": {
+                "agent_tone": agent_tone,
+                "customer_temperament": customer_temperament,
+                "target_turns": target_turns,
+            },
+        }
+        transcripts.append(transcript)
+
+    return transcripts
+
+
+def generate_transcripts(spec: Dict[str, Any], workers: int | None = None) -> Dict[str, Any]:
+    """
+    Generate transcripts for every event, one worker process per event.
+    workers=None uses all cores; workers=1 runs in-process (handy for debugging).
+    """
+    check_scenario_text(spec)
+    seed = spec["generation"]["seed"]
+    n_per_event = int(spec["generation"]["transcripts_per_event"])
+    jobs = [(event, spec, seed) for event in spec["events"]]
 
-    for event in spec["events"]:
-        event_id = event["event_id"]
-        event_name = event["event_name"]
-        channel = spec["meta"].get("default_channel", "phone")
-
-        for i in range(1, n_per_event + 1):
-            journey_type = pick_journey_type(rng, event_id, spec)
-            scenario = pick_scenario(rng, journey_type, spec)
-
-            sentiment = weighted_choice(rng, sentiments_dist)
-            outcome = weighted_choice(rng, outcomes_dist)
-            agent_tone = weighted_choice(rng, tone_dist)
-            customer_temperament = weighted_choice(rng, temp_dist)
-
-            target_turns = choose_turn_count(rng, spec)
-
-            turns = build_turns(
-                rng=rng,
-                scenario=scenario,
-                sentiment=sentiment,
-                outcome=outcome,
-                agent_tone=agent_tone,
-                customer_temperament=customer_temperament,
-                target_turns=target_turns,
-                speakers=speakers,
-            )
+    if workers == 1:
+        results = [_generate_for_event(*job) for job in jobs]
+    else:
+        # Events are coarse-grained, so hand them out one at a time
+        with multiprocessing.Pool(workers) as pool:
+            results = pool.starmap(_generate_for_event, jobs, chunksize=1)
 
-            transcript = {
-                "transcript_id": f"{event_id}-T{i:03d}",
-                "event_id": event_id,
-                "event_name": event_name,
-                "channel": channel,
-                "scenario_id": scenario["scenario_id"],
-                "journey_type": journey_type,
-                "sentiment": sentiment,
-                "outcome": outcome,
-                "turns": turns,
-                # optional debug/analysis fields (handy for evaluation)
-                "style": {
-                    "agent_tone": agent_tone,
-                    "customer_temperament": customer_temperament,
-                    "target_turns": target_turns,
-                },
-            }
-            transcripts.append(transcript)
+    transcripts = list(itertools.chain.from_iterable(results))
 
     return {
         "meta": spec["meta"],
         "generation": {
             "transcripts_per_event": n_per_event,
-            "seed": spec["generation"]["seed"],
+            "seed": seed,
             "total_transcripts": len(transcripts),
         },
         "transcripts": transcripts,
     }
 
 
-def main(spec_file, output_file):
+def main(spec_file, output_file, output_format="yaml", workers=None):
+    with open(spec_file, "r", encoding="utf-8") as f:
+        spec = yaml.load(f, Loader=_YamlLoader)
 
+    data = generate_transcripts(spec, workers=workers)
 
-    with open(spec_file, "r", encoding="utf-8") as f:
-        spec = yaml.safe_load(f)
+    if output_format == "json":
+        # Downstream indexers only need dict access, so JSON (orjson) is much cheaper to load
+        import orjson
 
-    data = generate_transcripts(spec)
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    elif output_format == "jsonl":
+        # One transcript per line so ingestion can stream with O(1) memory per transcript
+        import orjson
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+        with open(output_file, "wb") as f:
+            for tr in data["transcripts"]:
+                f.write(orjson.dumps(tr) + b"\n")
+    else:
+        with open(output_file, "w", encoding="utf-8") as f:
+            yaml.dump(data, f, Dumper=_YamlDumper, sort_keys=False, allow_unicode=True)
 
     print(f"Wrote {data['generation']['total_transcripts']} transcripts to {output_file}")
 
 
 if __name__ == "__main__":
-    main('data/spec_hsbc_transcripts.yaml', 'data/transcripts.yaml')
\ No newline at end of file
+    p = argparse.ArgumentParser()
+    p.add_argument("--spec", default="data/spec_hsbc_transcripts.yaml")
+    p.add_argument("--out", default=None, help="Output path (default: data/transcripts.<format>)")
+    p.add_argument("--output-format", choices=["yaml", "json", "jsonl"], default="yaml")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores; 1 = in-process)")
+    args = p.parse_args()
+
+    main(args.spec, args.out or f"data/transcripts.{args.output_format}", args.output_format, args.workers)
\ No newline at end of file
@@ -2,49 +2,74 @@ from __future__ import annotations
 
 import argparse
 import hashlib
-import json
 import os
 import sys
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
+import orjson
 import yaml
+from tqdm import tqdm
+
+# libyaml-backed loader when available (much faster on multi-MB transcript files)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 # ---- Weaviate v4 client imports ----
 import weaviate
 import weaviate.classes as wvc
 from weaviate.classes.init import Auth
 
+from embedding_cache import DEFAULT_CACHE_PATH, EmbeddingCache, embed_with_cache
+from journeyworks_core import stamp_index_version
+
 
-# ---------- YAML ----------
+# ---------- YAML / JSON ----------
 def load_yaml(path: str) -> Dict[str, Any]:
+    """
+    Load transcripts from YAML, or from JSON/JSONL when the path ends in .json/.jsonl
+    (as written by generate_transcripts.py --output-format json|jsonl).
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "rb") as f:
+            return {"transcripts": [orjson.loads(line) for line in f if line.strip()]}
+
+    if path.endswith(".json"):
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
 
 
 # ---------- Text building ----------
+_HEADER_FIELDS = ("event_name", "journey_type", "sentiment", "outcome", "channel")
+
+
 def transcript_to_text(tr: Dict[str, Any]) -> str:
     """
     Single 'document' text per transcript.
     Keep it simple for MVP RAG: metadata header + dialogue.
     """
-    header_bits = []
-    for k in ("event_name", "journey_type", "sentiment", "outcome", "channel"):
-        v = tr.get(k)
-        if v:
-            header_bits.append(f"{k}={v}")
-    header = " | ".join(header_bits)
+    header = " | ".join([f"{k}={tr[k]}" for k in _HEADER_FIELDS if tr.get(k)])
 
     lines: List[str] = []
-    turns = tr.get("turns", [])
+    append = lines.append
+    turns = tr.get("turns")
     if isinstance(turns, list):
         for t in turns:
-            spk = (t.get("speaker") or "").strip()
-            txt = (t.get("text") or "").strip()
+            spk = t.get("speaker")
+            txt = t.get("text")
+            # strip only when both are present (and re-check: whitespace-only is empty)
             if spk and txt:
-                lines.append(f"{spk}: {txt}")
+                spk = spk.strip()
+                txt = txt.strip()
+                if spk and txt:
+                    append(f"{spk}: {txt}")
 
-    body = "\n".join(lines).strip()
+    # each line is already stripped at both ends, so the joined body needs no strip
+    body = "\n".join(lines)
     if header:
         return f"{header}\n\n{body}"
     return body
@@ -59,25 +84,21 @@ def stable_uuid_for_transcript(tr: Dict[str, Any], idx: int) -> str:
     if isinstance(base, str) and base.strip():
         name = base.strip()
     else:
-        # Hash a few stable fields + first few turns
-        h = hashlib.sha256()
-        h.update(str(tr.get("event_name", "")).encode("utf-8"))
-        h.update(str(tr.get("journey_type", "")).encode("utf-8"))
-        h.update(str(tr.get("sentiment", "")).encode("utf-8"))
-        h.update(str(tr.get("outcome", "")).encode("utf-8"))
-        h.update(str(tr.get("channel", "")).encode("utf-8"))
+        # Hash a few stable fields + first few turns, as one buffer and one hash call.
+        # Unseparated sha256 on purpose: it matches the UUIDs of already-indexed objects.
+        parts = [str(tr.get(k, "")) for k in _HEADER_FIELDS]
         turns = tr.get("turns", [])
         if isinstance(turns, list):
             for t in turns[:6]:
-                h.update(str(t.get("speaker", "")).encode("utf-8"))
-                h.update(str(t.get("text", "")).encode("utf-8"))
-        h.update(str(idx).encode("utf-8"))
-        name = h.hexdigest()
+                parts.append(str(t.get("speaker", "")))
+                parts.append(str(t.get("text", "")))
+        parts.append(str(idx))
+        name = hashlib.sha256("".join(parts).encode("utf-8")).hexdigest()
 
     return str(uuid.uuid5(uuid.NAMESPACE_URL, f"journeyworks:{name}"))
 
 
-def build_properties(tr: Dict[str, Any], doc_text: str) -> Dict[str, Any]:
+def build_properties(tr: Dict[str, Any], doc_text: str, store_turns_json: bool = True) -> Dict[str, Any]:
     """
     Properties stored as normal fields (NOT the vector).
     Keep these small, filterable, and useful.
@@ -94,40 +115,43 @@ def build_properties(tr: Dict[str, Any], doc_text: str) -> Dict[str, Any]:
 
     # Optional: store turns as JSON string (handy for showing evidence)
     turns = tr.get("turns")
-    if isinstance(turns, list):
-        props["turns_json"] = json.dumps(turns, ensure_ascii=False)
+    if store_turns_json and isinstance(turns, list):
+        props["turns_json"] = orjson.dumps(turns).decode("utf-8")
 
     return props
 
 
 # ---------- Embeddings ----------
-def get_embedder(model_name: str):
+def get_embedder(model_name: str, cuda: bool = False):
     """
-    Local embedder via sentence-transformers.
-    Keep it simple; you can swap model_name later.
+    Local embedder via FastEmbed (ONNX Runtime, no PyTorch).
+    Same backend as ingest_transcripts_to_weaviate.py; quantized models such as
+    BAAI/bge-small-en-v1.5 are available, but the query scripts must use the same model.
     """
     try:
-        from sentence_transformers import SentenceTransformer
+        from fastembed import TextEmbedding
     except ImportError:
         print(
-            "Missing dependency: sentence-transformers\n"
+            "Missing dependency: fastembed\n"
             "Install with:\n"
-            "  pip install -U sentence-transformers\n",
+            "  pip install -U fastembed\n",
             file=sys.stderr,
         )
         raise
 
-    return SentenceTransformer(model_name)
+    if cuda:
+        return TextEmbedding(model_name, providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
+    return TextEmbedding(model_name)
 
 
-def embed_texts(embedder, texts: List[str]) -> List[List[float]]:
+def embed_texts(embedder, texts: List[str], batch_size: int = 256) -> List[List[float]]:
     """
     Returns Python lists (Weaviate client wants plain lists, not numpy arrays).
+    Pass the whole corpus in one call and let FastEmbed batch internally.
     """
-    # normalize_embeddings=True helps similarity search stability for many models
-    vecs = embedder.encode(texts, normalize_embeddings=True, show_progress_bar=False)
-    # vecs may be numpy array
-    return [v.tolist() for v in vecs]
+    vecs = np.stack(list(embedder.embed(texts, batch_size=batch_size)))
+    # One C-level conversion of the full 2D array
+    return vecs.tolist()
 
 
 # ---------- Weaviate ----------
@@ -155,6 +179,8 @@ def ensure_collection(client, name: str):
     """
     Create the collection if missing, configured for self-provided vectors (BYOV).
     Weaviate docs: vector_config=Configure.Vectors.self_provided().  [oai_citation:2‡Weaviate Documentation](https://docs.weaviate.io/weaviate/starter-guides/custom-vectors)
+    The HNSW index uses scalar quantization (SQ8): ~4x less index memory, with the top
+    candidates rescored against the original vectors.
     """
     try:
         exists = client.collections.exists(name)
@@ -169,7 +195,11 @@ def ensure_collection(client, name: str):
     # (Autoschema also works, but explicit is more stable for demos.)
     return client.collections.create(
         name,
-        vector_config=wvc.config.Configure.Vectors.self_provided(),
+        vector_config=wvc.config.Configure.Vectors.self_provided(
+            vector_index_config=wvc.config.Configure.VectorIndex.hnsw(
+                quantizer=wvc.config.Configure.VectorIndex.Quantizer.sq(rescore_limit=200, training_limit=100000),
+            ),
+        ),
         properties=[
             wvc.config.Property(name="text", data_type=wvc.config.DataType.TEXT),
             wvc.config.Property(name="event_name", data_type=wvc.config.DataType.TEXT),
@@ -197,7 +227,21 @@ def main():
     p.add_argument("--grpc-port", type=int, default=int(os.getenv("WEAVIATE_GRPC_PORT", "50051")))
     p.add_argument("--api-key", default=os.getenv("WEAVIATE_API_KEY"))
     p.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
-    p.add_argument("--batch-size", type=int, default=64)
+    p.add_argument("--batch-size", type=int, default=64, help="Objects per Weaviate insert_many call")
+    p.add_argument(
+        "--embed-batch-size",
+        type=int,
+        default=256,
+        help="Docs embedded per pipeline step (FastEmbed batch size); inserted while the next step embeds",
+    )
+    p.add_argument("--embed-cuda", action="store_true", help="Run FastEmbed on the ONNX Runtime CUDA provider")
+    p.add_argument("--embed-cache", default=DEFAULT_CACHE_PATH, help="sqlite file for cached embeddings")
+    p.add_argument("--no-embed-cache", action="store_true", help="Always re-embed; do not read or write the cache")
+    p.add_argument(
+        "--no-turns-json",
+        action="store_true",
+        help="Do not store turns_json (halves object size; query_transcripts.py --show-turns needs it)",
+    )
     p.add_argument("--limit", type=int, default=None)
     p.add_argument("--start", type=int, default=0)
     args = p.parse_args()
@@ -212,9 +256,6 @@ def main():
         print("No transcripts to index (empty slice).")
         return
 
-    print(f"Loading embedder: {args.embed_model}")
-    embedder = get_embedder(args.embed_model)
-
     print(f"Connecting to Weaviate at http://{args.host}:{args.port} (gRPC {args.grpc_port})")
     client = connect_weaviate(args.host, args.port, args.grpc_port, args.api_key)
 
@@ -230,39 +271,61 @@ def main():
                 continue
 
             uid = stable_uuid_for_transcript(tr, idx=i)
-            props = build_properties(tr, doc_text)
+            props = build_properties(tr, doc_text, store_turns_json=not args.no_turns_json)
             docs.append((uid, props, doc_text))
 
         if not docs:
             print("No non-empty documents to index.")
             return
 
-        print(f"Prepared {len(docs)} documents. Embedding + inserting in batches of {args.batch_size}...")
+        print(f"Prepared {len(docs)} documents.")
 
-        inserted = 0
-        for batch in chunked(docs, args.batch_size):
-            uuids = [b[0] for b in batch]
-            props_list = [b[1] for b in batch]
-            texts = [b[2] for b in batch]
+        embedder = None
 
-            vectors = embed_texts(embedder, texts)
+        def embed_fn(texts: List[str]) -> List[List[float]]:
+            # Only load the model when something actually needs embedding
+            nonlocal embedder
+            if embedder is None:
+                print(f"Loading embedder: {args.embed_model}")
+                embedder = get_embedder(args.embed_model, cuda=args.embed_cuda)
+            return embed_texts(embedder, texts, batch_size=args.embed_batch_size)
 
-            objs: List[wvc.data.DataObject] = []
-            for u, props, vec in zip(uuids, props_list, vectors):
-                objs.append(
+        def insert_chunk(batch: List[Tuple[Tuple[str, Dict[str, Any], str], List[float]]]) -> int:
+            n = 0
+            for part in chunked(batch, args.batch_size):
+                objs = [
                     wvc.data.DataObject(
                         uuid=u,
                         properties=props,
                         vector=vec,  # IMPORTANT: vector is not a property.  [oai_citation:3‡Weaviate Documentation](https://docs.weaviate.io/weaviate/starter-guides/custom-vectors)
                     )
-                )
-
-            res = col.data.insert_many(objs)
-
-            # Best-effort reporting; response structure varies by client version
-            inserted += len(objs)
-            print(f"Inserted {inserted}/{len(docs)}")
-
+                    for (u, props, _), vec in part
+                ]
+                col.data.insert_many(objs)
+                n += len(objs)
+            return n
+
+        # Pipeline: embed the next chunk on this thread while the previous one is inserted
+        # on a single insert thread. At most one insert is in flight at a time.
+        cache = None if args.no_embed_cache else EmbeddingCache(args.embed_cache, args.embed_model)
+        pending: Optional[Future] = None
+        pbar = tqdm(total=len(docs), unit="doc", desc="Inserted")
+        try:
+            with ThreadPoolExecutor(max_workers=1) as ins_pool:
+                for batch in chunked(docs, args.embed_batch_size):
+                    vectors = embed_with_cache([d[2] for d in batch], embed_fn, cache)
+                    if pending is not None:
+                        pbar.update(pending.result())
+                    pending = ins_pool.submit(insert_chunk, list(zip(batch, vectors)))
+
+                if pending is not None:
+                    pbar.update(pending.result())
+        finally:
+            pbar.close()
+            if cache is not None:
+                cache.close()
+
+        stamp_index_version(col)  # invalidates semantic-cache entries for the old contents
         print("Done.")
 
     finally:
@@ -1,21 +1,35 @@
 from __future__ import annotations
 
 import argparse
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, Iterator, List, Tuple
 
 import yaml
 import weaviate
+from tqdm import tqdm
 from weaviate.connect import ConnectionParams
 from weaviate.classes.config import Configure, Property, DataType
 from fastembed import TextEmbedding
 
+from embedding_cache import DEFAULT_CACHE_PATH, EmbeddingCache, embed_with_cache
+from journeyworks_core import stamp_index_version
+
+# libyaml-backed loader when available (much faster on multi-MB transcript files)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 # --------------------------
 # Chunking utilities
 # --------------------------
 
-def normalise_turns(turns: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
-    """Return list of (speaker, text) pairs."""
+def normalise_turns(turns: List[Dict[str, Any]], pre_normalized: bool = False) -> List[Tuple[str, str]]:
+    """
+    Return list of (speaker, text) pairs.
+    pre_normalized: trust that speaker/text are already trimmed strings (e.g. generate_transcripts.py
+    output) and skip the str()/strip() pass; turns with empty text are still dropped.
+    """
+    if pre_normalized:
+        return [(t.get("speaker") or "Unknown", t["text"]) for t in turns if t.get("text")]
+
     out = []
     for t in turns:
         speaker = str(t.get("speaker", "")).strip() or "Unknown"
@@ -25,50 +39,65 @@ def normalise_turns(turns: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
     return out
 
 
-def chunk_by_turns(
-    turns: List[Tuple[str, str]],
+def iter_chunk_objects(
+    t: Dict[str, Any],
     max_words: int = 220,
     overlap_turns: int = 1,
-) -> List[Dict[str, Any]]:
+    pre_normalized: bool = False,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
     """
-    Create chunks that contain whole turns only.
+    Yield (text, properties) for each chunk of a transcript, without building intermediate lists.
+    Chunks contain whole turns only.
     - max_words: approx chunk size
     - overlap_turns: how many turns to overlap between chunks (helps retrieval continuity)
-    Returns list of dicts: {chunk_index, text, turn_start, turn_end}
+    - pre_normalized: see normalise_turns
     """
-    chunks: List[Dict[str, Any]] = []
+    turns_raw = t.get("turns", [])
+    turns = normalise_turns(turns_raw if isinstance(turns_raw, list) else [], pre_normalized)
     n = len(turns)
-    i = 0
-    chunk_index = 0
+    if not n:
+        return
 
-    def turn_words(s: str) -> int:
-        return len(s.split())
+    # Build each line and its word count once; the packing loop below only indexes into them.
+    # "spk: txt".split() has exactly len(spk.split()) + len(txt.split()) words
+    # (the colon sticks to the speaker's last word).
+    lines_src = [f"{spk}: {txt}" for spk, txt in turns]
+    wcounts = [len(spk.split()) + len(txt.split()) for spk, txt in turns]
+
+    # Common metadata
+    base = {
+        "transcript_id": str(t.get("transcript_id", "")).strip(),
+        "event_id": str(t.get("event_id", "")).strip(),
+        "event_name": str(t.get("event_name", "")).strip(),
+        "journey_type": str(t.get("journey_type", "")).strip(),
+        "sentiment": str(t.get("sentiment", "")).strip(),
+        "outcome": str(t.get("outcome", "")).strip(),
+        "channel": str(t.get("channel", "phone")).strip(),
+        "turn_count": n,
+    }
 
+    i = 0
+    chunk_index = 0
     while i < n:
         words = 0
         start = i
-        lines = []
 
         while i < n:
-            spk, txt = turns[i]
-            line = f"{spk}: {txt}"
-            w = turn_words(line)
+            w = wcounts[i]
             # if adding this turn would exceed max_words and we already have content, stop
-            if lines and (words + w) > max_words:
+            if i > start and (words + w) > max_words:
                 break
-            lines.append(line)
             words += w
             i += 1
 
-        end = i - 1
-        chunks.append(
-            {
-                "chunk_index": chunk_index,
-                "text": "\n".join(lines),
-                "turn_start": start,
-                "turn_end": end,
-            }
-        )
+        text = "\n".join(lines_src[start:i])
+        yield text, {
+            "text": text,
+            **base,
+            "chunk_index": chunk_index,
+            "turn_start": start,
+            "turn_end": i - 1,
+        }
         chunk_index += 1
 
         # move back for overlap (but never below 0)
@@ -76,10 +105,9 @@ def chunk_by_turns(
             i = max(i - overlap_turns, 0)
 
         # safety: ensure progress even on pathological inputs
-        if i == start:
-            i += 1
-
-    return chunks
+        # (e.g. overlap_turns >= turns in the chunk just emitted)
+        if i <= start:
+            i = start + 1
 
 
 # --------------------------
@@ -87,13 +115,16 @@ def chunk_by_turns(
 # --------------------------
 
 def ensure_collection(client: weaviate.WeaviateClient, name: str) -> None:
-    """Create collection if it does not exist."""
+    """Create collection if it does not exist (HNSW with SQ8 quantization, rescored on the top candidates)."""
     if client.collections.exists(name):
         return
 
     client.collections.create(
         name=name,
         vectorizer_config=Configure.Vectorizer.none(),  # we provide vectors
+        vector_index_config=Configure.VectorIndex.hnsw(
+            quantizer=Configure.VectorIndex.Quantizer.sq(rescore_limit=200, training_limit=100000),
+        ),
         properties=[
             Property(name="text", data_type=DataType.TEXT),
 
@@ -119,20 +150,65 @@ def ensure_collection(client: weaviate.WeaviateClient, name: str) -> None:
 # --------------------------
 
 def load_yaml(path: str) -> Dict[str, Any]:
+    if path.endswith(".json"):
+        import orjson
+
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
+
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
+
+
+def iter_transcripts(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield transcripts one at a time.
+    JSONL input (generate_transcripts.py --output-format jsonl) is read line by line and
+    JSON input is streamed with ijson, so only one transcript is held in memory;
+    YAML input has no streaming equivalent and is loaded in full.
+    """
+    if path.endswith(".jsonl"):
+        import orjson
+
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield orjson.loads(line)
+        return
+
+    if path.endswith(".json"):
+        import ijson
+
+        with open(path, "rb") as f:
+            yield from ijson.items(f, "transcripts.item")
+        return
+
+    data = load_yaml(path)
+    transcripts = data.get("transcripts", [])
+    if not isinstance(transcripts, list):
+        raise ValueError("Input YAML does not contain a 'transcripts' list")
+    yield from transcripts
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--in", dest="inp", required=True, help="Input YAML (hsbc_transcripts_2000.yaml)")
+    parser.add_argument("--in", dest="inp", required=True, help="Input YAML, JSON or JSONL (hsbc_transcripts_2000.yaml)")
     parser.add_argument("--collection", default="TranscriptChunk")
     parser.add_argument("--embed_model", default="BAAI/bge-small-en-v1.5")
     parser.add_argument("--max_words", type=int, default=220)
     parser.add_argument("--overlap_turns", type=int, default=1)
     parser.add_argument("--batch_size", type=int, default=64)
+    parser.add_argument(
+        "--pre_normalized",
+        action="store_true",
+        help="Input turns are already trimmed strings (generate_transcripts.py output); skip re-normalising them",
+    )
+    parser.add_argument("--embed_cache", default=DEFAULT_CACHE_PATH, help="sqlite file for cached embeddings")
+    parser.add_argument("--no_embed_cache", action="store_true", help="Always re-embed; do not read or write the cache")
     args = parser.parse_args()
 
+    cache = None if args.no_embed_cache else EmbeddingCache(args.embed_cache, args.embed_model)
+
     # Connect to Weaviate v4 (HTTP + gRPC)
     client = weaviate.WeaviateClient(
         connection_params=ConnectionParams.from_url("http://localhost:8080", grpc_port=50051)
@@ -146,15 +222,17 @@ def main():
         ensure_collection(client, args.collection)
         col = client.collections.get(args.collection)
 
-        # Embeddings (fast, local, no torch)
-        embedder = TextEmbedding(args.embed_model)
+        # Embeddings (fast, local, no torch); the model is only loaded on the first cache miss
+        embedder = None
 
-        data = load_yaml(args.inp)
-        transcripts = data.get("transcripts", [])
-        if not isinstance(transcripts, list):
-            raise ValueError("Input YAML does not contain a 'transcripts' list")
+        def embed_fn(texts: List[str]) -> List[List[float]]:
+            nonlocal embedder
+            if embedder is None:
+                embedder = TextEmbedding(args.embed_model)
+            return [vec.tolist() for vec in embedder.embed(texts)]  # numpy arrays -> lists
 
         total_chunks = 0
+        pbar = tqdm(unit="chunk", desc="Inserted")  # total unknown: input is streamed
         texts_for_batch: List[str] = []
         objects_for_batch: List[Dict[str, Any]] = []
 
@@ -163,67 +241,37 @@ def main():
             if not objects_for_batch:
                 return
 
-            vectors = list(embedder.embed(texts_for_batch))  # returns numpy arrays
+            vectors = embed_with_cache(texts_for_batch, embed_fn, cache)
             with col.batch.fixed_size(batch_size=len(objects_for_batch)) as batch:
                 for obj, vec in zip(objects_for_batch, vectors):
-                    batch.add_object(properties=obj, vector=vec.tolist())
+                    batch.add_object(properties=obj, vector=vec)
 
             total_chunks += len(objects_for_batch)
+            pbar.update(len(objects_for_batch))
             texts_for_batch = []
             objects_for_batch = []
 
-        for t in transcripts:
-            turns_raw = t.get("turns", [])
-            turns = normalise_turns(turns_raw if isinstance(turns_raw, list) else [])
-            if not turns:
-                continue
-
-            chunks = chunk_by_turns(
-                turns,
-                max_words=args.max_words,
-                overlap_turns=args.overlap_turns,
-            )
-
-            # Common metadata
-            transcript_id = str(t.get("transcript_id", "")).strip()
-            event_id = str(t.get("event_id", "")).strip()
-            event_name = str(t.get("event_name", "")).strip()
-            journey_type = str(t.get("journey_type", "")).strip()
-            sentiment = str(t.get("sentiment", "")).strip()
-            outcome = str(t.get("outcome", "")).strip()
-            channel = str(t.get("channel", "phone")).strip()
-            turn_count = len(turns)
-
-            for ch in chunks:
-                obj = {
-                    "text": ch["text"],
-
-                    "transcript_id": transcript_id,
-                    "event_id": event_id,
-                    "event_name": event_name,
-
-                    "journey_type": journey_type,
-                    "sentiment": sentiment,
-                    "outcome": outcome,
-                    "channel": channel,
-
-                    "chunk_index": int(ch["chunk_index"]),
-                    "turn_start": int(ch["turn_start"]),
-                    "turn_end": int(ch["turn_end"]),
-                    "turn_count": int(turn_count),
-                }
-
-                objects_for_batch.append(obj)
-                texts_for_batch.append(ch["text"])
-
-                if len(objects_for_batch) >= args.batch_size:
-                    flush_batch()
-
-        flush_batch()
+        try:
+            for t in iter_transcripts(args.inp):
+                for text, obj in iter_chunk_objects(
+                    t, max_words=args.max_words, overlap_turns=args.overlap_turns, pre_normalized=args.pre_normalized
+                ):
+                    objects_for_batch.append(obj)
+                    texts_for_batch.append(text)
+
+                    if len(objects_for_batch) >= args.batch_size:
+                        flush_batch()
+
+            flush_batch()
+        finally:
+            pbar.close()
+        stamp_index_version(col)  # invalidates semantic-cache entries for the old contents
 
         print(f"Done. Inserted {total_chunks} chunks into collection '{args.collection}'.")
 
     finally:
+        if cache is not None:
+            cache.close()
         client.close()
 
 
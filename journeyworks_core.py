@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import sys
+import time
+import urllib.request
+from functools import lru_cache, reduce
+from operator import and_
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import numpy as np
+import weaviate
+import weaviate.classes as wvc
+from weaviate.classes.init import AdditionalConfig, Auth, Timeout
+
+from onnx_embedder import DEFAULT_ONNX_MODEL_DIR, get_embedder_onnx
+
+
+# ---------- Embeddings ----------
+@lru_cache(maxsize=4)
+def get_embedder(model_name: str, backend: str = "torch", onnx_dir: str = DEFAULT_ONNX_MODEL_DIR):
+    """Load the query embedder; repeated calls with the same arguments share one in-memory model."""
+    if backend == "onnx":
+        # exported/quantised copy of model_name, see onnx_embedder.py
+        return get_embedder_onnx(onnx_dir)
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print(
+            "Missing dependency: sentence-transformers\n"
+            "Install with:\n"
+            "  pip install -U sentence-transformers\n",
+            file=sys.stderr,
+        )
+        raise
+    import torch
+
+    # server processes often default to a single intra-op thread
+    torch.set_num_threads(int(os.getenv("EMBED_THREADS", str(os.cpu_count() or 4))))
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # can only be set before torch starts parallel work
+    model = SentenceTransformer(model_name)
+    model.eval()
+    return model
+
+
+def embedder_key(model_name: str, backend: str = "torch", onnx_dir: str = DEFAULT_ONNX_MODEL_DIR) -> str:
+    """Identifies the vectors get_embedder(...) produces; torch and int8 ONNX vectors differ slightly."""
+    return model_name if backend != "onnx" else f"{model_name}|onnx:{onnx_dir}"
+
+
+@lru_cache(maxsize=4096)
+def _embed_cached(embedder, text: str) -> np.ndarray:
+    vec = np.asarray(embedder.encode([text], normalize_embeddings=True, show_progress_bar=False)[0], dtype=np.float32)
+    vec.setflags(write=False)  # shared by every caller of the cached entry
+    return vec
+
+
+def embed_query(embedder, text: str) -> np.ndarray:
+    # exact repeats of a question skip the model forward pass; the float32 array goes to
+    # Weaviate and the semantic cache as is, without boxing every component as a Python float
+    return _embed_cached(embedder, text)
+
+
+# ---------- Weaviate ----------
+# Seconds; queries go over the gRPC channel, init/readiness over HTTP
+WEAVIATE_TIMEOUT = Timeout(init=10, query=30, insert=60)
+
+# The indexing scripts stamp this on a collection's description after every load, so results
+# cached against the old contents stop matching once the collection is re-seeded.
+INDEX_STAMP_PREFIX = "indexed_at="
+# Seconds a long-lived session trusts the stamp it read before asking Weaviate again
+INDEX_VERSION_TTL = 30.0
+
+
+def stamp_index_version(col) -> None:
+    """Record a fresh index timestamp on col; read back by WeaviateSession.index_version."""
+    col.config.update(description=f"{INDEX_STAMP_PREFIX}{time.time_ns()}")
+
+
+def connect_weaviate(host: str, port: int, grpc_port: int, api_key: Optional[str]):
+    client = weaviate.connect_to_local(
+        host=host,
+        port=port,
+        grpc_port=grpc_port,
+        auth_credentials=Auth.api_key(api_key) if api_key else None,
+        additional_config=AdditionalConfig(timeout=WEAVIATE_TIMEOUT),
+    )
+
+    if not client.is_ready():
+        raise RuntimeError("Weaviate is not ready (check container, ports, auth).")
+    return client
+
+
+class WeaviateSession:
+    """
+    A Weaviate client that connects on first use, plus the collection handles fetched through
+    it, so existence checks and handle lookups happen once per collection rather than per query.
+    """
+
+    def __init__(self, host: str, port: int, grpc_port: int, api_key: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.grpc_port = grpc_port
+        self.api_key = api_key
+        self._client = None
+        self._collections: Dict[str, Any] = {}
+        self._versions: Dict[str, Tuple[str, float]] = {}
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
+    @property
+    def endpoint(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def connect(self):
+        """Connect now rather than on first use (so a bad endpoint fails early); returns the client."""
+        if self._client is None:
+            self._client = connect_weaviate(self.host, self.port, self.grpc_port, self.api_key)
+        return self._client
+
+    @property
+    def client(self):
+        return self.connect()
+
+    def collection(self, name: str):
+        col = self._collections.get(name)
+        if col is None:
+            if not self.client.collections.exists(name):
+                raise RuntimeError(f"Collection '{name}' does not exist. Run the indexing script for it first.")
+            col = self._collections[name] = self.client.collections.get(name)
+        return col
+
+    def index_version(self, name: str) -> str:
+        """Index stamp of collection name ("" if it was never stamped), re-read every INDEX_VERSION_TTL s."""
+        now = time.monotonic()
+        cached = self._versions.get(name)
+        if cached is None or now - cached[1] > INDEX_VERSION_TTL:
+            description = self.collection(name).config.get(simple=True).description or ""
+            cached = self._versions[name] = (description, now)
+        return cached[0]
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        self._collections.clear()
+        self._versions.clear()
+
+
+@lru_cache(maxsize=None)
+def get_session(host: str, port: int, grpc_port: int, api_key: Optional[str] = None) -> WeaviateSession:
+    """One session per endpoint for the whole process; it is closed at interpreter exit."""
+    session = WeaviateSession(host, port, grpc_port, api_key)
+    atexit.register(session.close)
+    return session
+
+
+# Built once and shared by every query (the client only reads it)
+DISTANCE_METADATA = wvc.query.MetadataQuery(distance=True)
+
+
+def equal_filters(fields: Iterable[Tuple[str, Optional[str]]]) -> Optional[wvc.query.Filter]:
+    """
+    AND of property == value for every (property, value) pair with a value set, or None.
+    Properties must match what we indexed.
+    """
+    clauses = [wvc.query.Filter.by_property(prop).equal(value) for prop, value in fields if value]
+    return reduce(and_, clauses) if clauses else None
+
+
+# ---------- Misc ----------
+def clamp(s: str, n: int) -> str:
+    s = (s or "").strip()
+    if len(s) <= n:
+        return s
+    return s[: n - 1].rstrip() + "…"
+
+
+def post_json(url: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """POST payload to a running rag_server.py and return its JSON response."""
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(req) as resp:
+        return json.loads(resp.read())
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from llama_cpp import Llama
+
+
+# llama.cpp stops scaling past ~16 threads for a 7B model on CPU
+DEFAULT_N_THREADS = min(16, os.cpu_count() or 8)
+
+
+def load_llm(
+    model_path: str,
+    n_ctx: int = 4096,
+    n_batch: int = 2048,
+    n_ubatch: int = 512,
+    n_threads: Optional[int] = None,
+    n_gpu_layers: int = 999,
+    use_mlock: bool = False,
+    warm_prefix: str = "",
+) -> Llama:
+    """
+    Load a GGUF with the tuned prefill / threading settings shared by the scripts.
+    warm_prefix, if given, is evaluated straight away so the first prompt that starts with it
+    only prefills what follows.
+    """
+    n_threads = n_threads or DEFAULT_N_THREADS
+    llm = Llama(
+        model_path=model_path,
+        n_ctx=n_ctx,
+        n_gpu_layers=n_gpu_layers,
+        n_threads=n_threads,
+        n_threads_batch=n_threads,
+        n_batch=n_batch,
+        n_ubatch=min(n_ubatch, n_batch),
+        use_mlock=use_mlock,
+        logits_all=False,
+        verbose=False,
+    )
+    if warm_prefix:
+        llm.eval(llm.tokenize(warm_prefix.encode("utf-8")))
+    return llm
@@ -1,10 +1,74 @@
-from llama_cpp import Llama
+from __future__ import annotations
+
+import argparse
 import logging
+from typing import List, Optional
+
+import llama_cpp
+from llama_cpp import Llama
+
 logging.getLogger().setLevel(logging.WARNING)
-llama = Llama(model_path='models/mistral-7b-instruct-v0.2.Q5_K_M.gguf', verbose=False, n_ctx=3276, n_threads=8, n_gpus=35,            n_gpu_layers=999)
-response = llama("Generate 20 very happy tweets regarding HSBC's announcement of its ISA interest rate tracking the Bank Of England Rate. Please only provide the text. Do not respond with anything else.",
-                 max_tokens=1000,
-                 temperature=0.8)
-print(response['choices'][0]['text'])
 
-#"Generate 20 very happy tweets regarding HSBC's announcement of its ISA interest rate tracking the Bank Of England Rate. Please only provide the text. Do not respond with anything else."
\ No newline at end of file
+MODEL_PATH = 'models/mistral-7b-instruct-v0.2.Q5_K_M.gguf'
+
+DEFAULT_PROMPT = "Generate 20 very happy tweets regarding HSBC's announcement of its ISA interest rate tracking the Bank Of England Rate. Please only provide the text. Do not respond with anything else."
+
+_LLM: Optional[Llama] = None
+
+
+def _gpu_layers() -> int:
+    """Offload everything on CUDA/Metal builds; 0 on CPU-only builds so llama.cpp skips the offload fallback."""
+    supports = getattr(llama_cpp, "llama_supports_gpu_offload", None)
+    return 999 if supports is not None and supports() else 0
+
+
+def get_llama() -> Llama:
+    """
+    Load the model once per process and reuse it; loading the GGUF dwarfs generating one prompt.
+    """
+    global _LLM
+    if _LLM is None:
+        n_gpu_layers = _gpu_layers()
+        _LLM = Llama(
+            model_path=MODEL_PATH,
+            verbose=False,
+            n_ctx=3276,
+            n_threads=8,
+            n_threads_batch=8,
+            n_gpu_layers=n_gpu_layers,
+            n_batch=512,
+            n_ubatch=512,
+            use_mmap=True,
+            use_mlock=False,
+            flash_attn=True,
+            offload_kqv=True,
+            logits_all=False,
+        )
+        block_count = next((v for k, v in _LLM.metadata.items() if k.endswith(".block_count")), "?")
+        logging.info("Loaded %s: %s layers, n_gpu_layers=%d", MODEL_PATH, block_count, n_gpu_layers)
+    return _LLM
+
+
+def generate(prompts: List[str], max_tokens: int = 1000, temperature: float = 0.8) -> List[str]:
+    """
+    Run prompts sequentially, one completion at a time (not batched decoding), on the warm model.
+    What is saved is reload and prefill: llama-cpp-python keeps the KV cache between calls and
+    only evaluates tokens after the longest prefix shared with the previous prompt, so prompts
+    with a common preamble skip re-processing it.
+    """
+    llama = get_llama()
+    return [
+        llama(prompt, max_tokens=max_tokens, temperature=temperature)['choices'][0]['text']
+        for prompt in prompts
+    ]
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument("--prompt", action="append", help="Prompt to run (repeatable); defaults to the HSBC tweets prompt")
+    p.add_argument("--max-tokens", type=int, default=1000)
+    p.add_argument("--temp", type=float, default=0.8)
+    args = p.parse_args()
+
+    for text in generate(args.prompt or [DEFAULT_PROMPT], max_tokens=args.max_tokens, temperature=args.temp):
+        print(text)
@@ -1,29 +1,80 @@
 from __future__ import annotations
 
 import argparse
+import atexit
 import json
-import re
-from typing import Any, Dict, List
+import logging
+import os
+import sys
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
+import orjson
 import yaml
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaGrammar
+
+logger = logging.getLogger(__name__)
+
+# libyaml-backed loader/dumper when available (much faster on multi-MB transcript files)
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+STOP = ["</s>", "[INST]"]
+
+# Generation budget per turn when decoding under the grammar (JSON keys + one rewritten line)
+TOKENS_PER_TURN = 80
+
+# Log progress every N finished transcripts rather than after each one
+PROGRESS_EVERY = 25
+
+# (prompt, GBNF grammar, max_tokens) for one transcript
+Job = Tuple[str, str, int]
+
+# Loaded models keyed by (model_path, n_ctx, n_gpu_layers), kept for the life of the process
+_LLM_CACHE: Dict[Tuple[str, int, int], Llama] = {}
+
+
+def _close_llms() -> None:
+    for llm in _LLM_CACHE.values():
+        llm.close()
+    _LLM_CACHE.clear()
+
+
+atexit.register(_close_llms)
+
+
+def get_llm(model_path: str, n_ctx: int, n_gpu_layers: int) -> Llama:
+    """
+    Load a GGUF model once and reuse it across naturalise_file calls; loading and offloading
+    a multi-GB model costs far more than naturalising a single transcript.
+    """
+    key = (model_path, n_ctx, n_gpu_layers)
+    llm = _LLM_CACHE.get(key)
+    if llm is None:
+        llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_gpu_layers=n_gpu_layers,
+            n_batch=512,
+            verbose=False,
+        )
+        _LLM_CACHE[key] = llm
+    return llm
 
 
 def load_yaml(path: str) -> Dict[str, Any]:
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=_YamlLoader)
 
 
 def save_yaml(path: str, data: Dict[str, Any]) -> None:
     with open(path, "w", encoding="utf-8") as f:
-        yaml.safe_dump(data, f, sort_keys=False, allow_unicode=True)
+        yaml.dump(data, f, Dumper=_YamlDumper, sort_keys=False, allow_unicode=True)
 
 
 def clamp_text(s: str, max_chars: int) -> str:
     s = s.strip()
-    if len(s) <= max_chars:
-        return s
-    return s[: max_chars - 1].rstrip() + "…"
+    return s if len(s) <= max_chars else s[: max_chars - 1].rstrip() + "…"
 
 
 def build_prompt(transcript: Dict[str, Any], style: Dict[str, Any]) -> str:
@@ -38,13 +89,9 @@ def build_prompt(transcript: Dict[str, Any], style: Dict[str, Any]) -> str:
     channel = transcript.get("channel", "phone")
 
     # Compact the original to keep prompt size stable
-    original_turns = transcript.get("turns", [])
-    original_lines = []
-    for t in original_turns:
-        spk = t.get("speaker", "")
-        txt = clamp_text(t.get("text", ""), 220)
-        original_lines.append(f"{spk}: {txt}")
-    original_text = "\n".join(original_lines)
+    original_text = "\n".join(
+        f"{t.get('speaker', '')}: {clamp_text(t.get('text', ''), 220)}" for t in transcript.get("turns", [])
+    )
 
     # Style controls (UK feel, agent tone, etc.)
     uk_register = style.get("uk_register", "UK contact centre (polite, natural)")
@@ -94,36 +141,242 @@ Now rewrite it. Remember: JSON only.
     return prompt
 
 
-def parse_json_turns(raw: str, expected_len: int) -> List[Dict[str, str]] | None:
+def _gbnf_literal(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def build_turns_grammar(speakers: Sequence[str]) -> str:
     """
-    Try to extract JSON object from model output robustly.
+    GBNF grammar for {"turns":[...]} with exactly one object per original turn, each pinned to
+    that turn's speaker, so the model can only emit schema-valid JSON of the right shape.
     """
-    raw = raw.strip()
+    items = []
+    for i, spk in enumerate(speakers):
+        speaker_json = _gbnf_literal(json.dumps(spk, ensure_ascii=False))
+        items.append(
+            f'turn{i} ::= "{{" ws "\\"speaker\\"" ws ":" ws {speaker_json} ws "," ws '
+            f'"\\"text\\"" ws ":" ws string ws "}}"'
+        )
+    seq = ' ws "," ws '.join(f"turn{i}" for i in range(len(speakers)))
+    return "\n".join(
+        [
+            f'root ::= "{{" ws "\\"turns\\"" ws ":" ws "[" ws {seq} ws "]" ws "}}"',
+            *items,
+            'string ::= "\\"" ( [^"\\\\\\x00-\\x1f] | "\\\\" ( ["\\\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\\""',
+            'ws ::= [ \\t\\n]?',
+        ]
+    )
+
+
+@lru_cache(maxsize=64)
+def _compiled_grammar(gbnf: str) -> LlamaGrammar:
+    # Transcripts share a handful of speaker sequences, so most grammars are reused
+    return LlamaGrammar.from_string(gbnf, verbose=False)
 
-    # Some models may prefix stray text; attempt to find a JSON object
-    m = re.search(r"\{.*\}", raw, flags=re.DOTALL)
-    if not m:
+
+def _extract_json_object(s: str) -> str | None:
+    """
+    Return the first balanced {...} object in s, or None.
+    Single forward pass tracking brace depth; braces inside JSON strings are ignored.
+    Unlike a greedy regex, trailing chatter containing '}' after the object is not swallowed.
+    """
+    start = s.find("{")
+    if start < 0:
         return None
 
+    depth = 0
+    in_string = False
+    escape = False
+    for i in range(start, len(s)):
+        c = s[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            depth += 1
+        elif c == "}":
+            depth -= 1
+            if depth == 0:
+                return s[start : i + 1]
+    return None
+
+
+def parse_json_turns(raw: str, expected_len: int) -> List[Dict[str, str]] | None:
+    """
+    Parse the model's JSON output. Grammar-constrained output is plain JSON, so a single
+    orjson.loads normally suffices; the brace scan only covers stray text around the object.
+    """
+    raw = raw.strip()
+
     try:
-        obj = json.loads(m.group(0))
-    except Exception:
-        return None
+        obj = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        # Some models may prefix stray text; attempt to find a JSON object
+        obj_text = _extract_json_object(raw)
+        if obj_text is None:
+            return None
+        try:
+            obj = orjson.loads(obj_text)
+        except orjson.JSONDecodeError:
+            return None
 
+    if not isinstance(obj, dict):
+        return None
     turns = obj.get("turns")
     if not isinstance(turns, list) or len(turns) != expected_len:
         return None
 
-    cleaned: List[Dict[str, str]] = []
-    for t in turns:
-        if not isinstance(t, dict):
-            return None
-        spk = t.get("speaker")
-        txt = t.get("text")
-        if not isinstance(spk, str) or not isinstance(txt, str):
-            return None
-        cleaned.append({"speaker": spk.strip(), "text": txt.strip()})
-    return cleaned
+    _str, _isinstance = str, isinstance
+    if not all(
+        _isinstance(t, dict) and _isinstance(t.get("speaker"), _str) and _isinstance(t.get("text"), _str)
+        for t in turns
+    ):
+        return None
+    return [{"speaker": t["speaker"].strip(), "text": t["text"].strip()} for t in turns]
+
+
+def complete_local(
+    llm: Llama,
+    jobs: List[Job],
+    temperature: float,
+    top_p: float,
+    on_result: Callable[[int, str], None],
+) -> None:
+    """
+    Run prompts one after another on a single in-process Llama, calling on_result(job_index, text)
+    as each finishes.
+    A Llama instance is not thread-safe, so there is no concurrency here; use a llama-server
+    (complete_server) to decode several transcripts at once.
+    """
+    for k, (prompt, gbnf, max_tokens) in enumerate(jobs):
+        out = llm(
+            prompt,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            top_p=top_p,
+            stop=STOP,
+            grammar=_compiled_grammar(gbnf),
+        )
+        on_result(k, out["choices"][0]["text"])
+
+
+def complete_server(
+    server_url: str,
+    jobs: List[Job],
+    parallel: int,
+    temperature: float,
+    top_p: float,
+    on_result: Callable[[int, str], None],
+) -> None:
+    """
+    Send prompts to a running llama-server (llama.cpp), calling on_result(job_index, text) in
+    completion order. Start it with as many slots as requests in flight so they are decoded
+    as one batch, e.g.
+      llama-server -m models/mistral-7b-instruct-v0.2.Q5_K_M.gguf --parallel 8 --cont-batching -c 32768
+    (n_ctx is shared between slots, so give each slot enough room for one transcript.)
+    """
+    import asyncio
+
+    try:
+        import httpx
+    except ImportError:
+        print(
+            "Missing dependency: httpx\n"
+            "Install with:\n"
+            "  pip install -U httpx\n",
+            file=sys.stderr,
+        )
+        raise
+
+    async def run() -> None:
+        sem = asyncio.Semaphore(parallel)
+        async with httpx.AsyncClient(base_url=server_url, timeout=None) as client:
+
+            async def one(k: int, prompt: str, gbnf: str, max_tokens: int) -> Tuple[int, str]:
+                async with sem:
+                    r = await client.post(
+                        "/completion",
+                        json={
+                            "prompt": prompt,
+                            "n_predict": max_tokens,
+                            "temperature": temperature,
+                            "top_p": top_p,
+                            "stop": STOP,
+                            "grammar": gbnf,
+                            "cache_prompt": True,
+                        },
+                    )
+                    r.raise_for_status()
+                    return k, r.json()["content"]
+
+            for fut in asyncio.as_completed([one(k, *job) for k, job in enumerate(jobs)]):
+                on_result(*(await fut))
+
+    asyncio.run(run())
+
+
+def checkpoint_header(in_path: str, start: int, limit: int | None, style: Dict[str, Any]) -> Dict[str, Any]:
+    """What a checkpoint was written for; resuming with anything else would mix two runs."""
+    return {"in_path": os.path.abspath(in_path), "start": start, "limit": limit, "style": style}
+
+
+def read_checkpoint_header(path: str) -> Optional[Dict[str, Any]]:
+    """The {"header": {...}} record naturalise_file writes as the sidecar's first line, if any."""
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.readline()
+    try:
+        rec = json.loads(first)
+    except ValueError:
+        return None
+    return rec.get("header") if isinstance(rec, dict) else None
+
+
+def drop_partial_tail(path: str) -> None:
+    """
+    Truncate the sidecar back to its last newline, so the first record appended on resume
+    starts on a line of its own instead of being glued onto one cut short by a crash.
+    """
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            step = min(1 << 16, pos)
+            f.seek(pos - step)
+            block = f.read(step)
+            nl = block.rfind(b"\n")
+            if nl != -1:
+                pos = pos - step + nl + 1
+                break
+            pos -= step
+        if pos < end:
+            logger.warning("Dropping %d bytes of a partially written record from %s", end - pos, path)
+            f.truncate(pos)
+
+
+def load_checkpoint(path: str) -> Dict[int, Dict[str, Any]]:
+    """
+    Read the JSONL sidecar written by naturalise_file: a header line, then one
+    {"index": i, "transcript": {...}} per completed transcript. A partially written last line
+    (crash mid-write) is ignored; drop_partial_tail removes it before a resumed run appends.
+    """
+    done: Dict[int, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "index" in rec:
+                done[rec["index"]] = rec["transcript"]
+    return done
 
 
 def naturalise_file(
@@ -138,7 +391,20 @@ def naturalise_file(
     limit: int | None,
     start: int,
     style: Dict[str, Any],
+    server_url: str | None = None,
+    parallel: int = 8,
+    resume: bool = False,
 ) -> None:
+    """
+    server_url: base URL of a llama-server (e.g. http://localhost:8081) to batch transcripts
+    through it up to `parallel` at a time; None loads model_path in-process instead.
+
+    Each finished transcript is appended to out_path + ".jsonl" straight away, so a crash
+    only loses the transcripts in flight; resume=True skips those already in that file.
+    The file starts with the input path, start, limit and style it was written for, and
+    resuming with different ones raises ValueError.
+    The YAML (with the naturalisation metadata block) is only written once all are done.
+    """
     data = load_yaml(in_path)
     transcripts = data.get("transcripts", [])
 
@@ -149,90 +415,100 @@ def naturalise_file(
     end = None if limit is None else start + limit
     subset = transcripts[start:end]
 
-    llm = None
-    try:
-        llm = Llama(
-            model_path=model_path,
-            n_ctx=n_ctx,
-            n_gpu_layers=n_gpu_layers,
-            verbose=False,
-        )
-
-        rewritten: List[Dict[str, Any]] = []
-        for idx, tr in enumerate(subset, start=start):
-            turns = tr.get("turns", [])
-            if not isinstance(turns, list) or len(turns) == 0:
-                rewritten.append(tr)
-                continue
-
-            prompt = build_prompt(tr, style)
-            print(f'PROMPT: {prompt}')
-
-            out = llm(
-                prompt,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=top_p,
-                stop=["</s>", "[INST]"],
+    checkpoint_path = out_path + ".jsonl"
+    # round-tripped through JSON so it compares equal to the stored copy
+    header = json.loads(json.dumps(checkpoint_header(in_path, start, limit, style)))
+    resume = resume and os.path.exists(checkpoint_path)
+    if resume:
+        stored = read_checkpoint_header(checkpoint_path)
+        if stored != header:
+            raise ValueError(
+                f"{checkpoint_path} was written for {stored} but this run is {header}; "
+                "refusing to resume (delete it or run without --resume)"
             )
-
-            text = out["choices"][0]["text"]
-            print(f"TEXT: {text}")
-            new_turns = parse_json_turns(text, expected_len=len(turns))
-
+        drop_partial_tail(checkpoint_path)
+    done = load_checkpoint(checkpoint_path) if resume else {}
+    if done:
+        logger.info("Resuming: %d transcripts already in %s", len(done), checkpoint_path)
+
+    # Build every remaining prompt up front so they can be submitted together
+    todo = [
+        i for i, tr in enumerate(subset)
+        if start + i not in done and isinstance(tr.get("turns", []), list) and len(tr.get("turns", [])) > 0
+    ]
+    jobs: List[Job] = []
+    for i in todo:
+        turns = subset[i]["turns"]
+        prompt = build_prompt(subset[i], style)
+        logger.debug("PROMPT: %s", prompt)
+        # The grammar rules out preamble/commentary, so the budget only has to cover the turns
+        gbnf = build_turns_grammar([str(t.get("speaker", "")) for t in turns])
+        jobs.append((prompt, gbnf, min(max_tokens, TOKENS_PER_TURN * len(turns))))
+
+    finished = 0
+    with open(checkpoint_path, "a" if resume else "w", encoding="utf-8") as ckpt:
+        if not resume:
+            ckpt.write(json.dumps({"header": header}, ensure_ascii=False) + "\n")
+            ckpt.flush()
+
+        def on_result(k: int, text: str) -> None:
+            nonlocal finished
+            pos = todo[k]
+            idx = start + pos
+            tr = subset[pos]
+            logger.debug("TEXT: %s", text)
+            new_turns = parse_json_turns(text, expected_len=len(tr["turns"]))
+
+            tr2 = dict(tr)
             if new_turns is None:
                 # fall back: keep original if parsing fails
-                tr2 = dict(tr)
                 tr2["naturalised"] = {
                     "status": "failed_parse",
                     "model_output_snippet": clamp_text(text, 300),
                 }
-                rewritten.append(tr2)
             else:
-                tr2 = dict(tr)
                 tr2["turns"] = new_turns
                 tr2["naturalised"] = {"status": "ok"}
-                rewritten.append(tr2)
+
+            ckpt.write(json.dumps({"index": idx, "transcript": tr2}, ensure_ascii=False) + "\n")
+            ckpt.flush()
 
             # lightweight progress
-            print(f"Processed {idx+1} transcripts...")
-
-        # Rebuild output
-        out_data = dict(data)
-        out_data["transcripts"] = rewritten
-        out_data["naturalisation"] = {
-            "model_path": model_path,
-            "n_ctx": n_ctx,
-            "n_gpu_layers": n_gpu_layers,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "top_p": top_p,
-            "start": start,
-            "limit": limit,
-            "style": style,
-        }
-
-        save_yaml(out_path, out_data)
-        print(f"Wrote naturalised YAML: {out_path}")
-
-    finally:
-        if llm is not None:
-            llm.close()
-
-
-def main(inp, out, model, n_ctx=4096, n_gpu_layers=999, max_tokens=900, temp=0.35, top_p=0.95, start=0, limit=None):
-    # p = argparse.ArgumentParser()
-    # p.add_argument("--in", dest="inp", required=True, help="Input YAML (generated transcripts)")
-    # p.add_argument("--out", dest="out", required=True, help="Output YAML (naturalised transcripts)")
-    # p.add_argument("--model", required=True, help="Path to Mistral GGUF")
-    # p.add_argument("--n_ctx", type=int, default=4096)
-    # p.add_argument("--n_gpu_layers", type=int, default=999, help="Use 999 to offload as many as possible (Metal)")
-    # p.add_argument("--max_tokens", type=int, default=900)
-    # p.add_argument("--temperature", type=float, default=0.35)
-    # p.add_argument("--top_p", type=float, default=0.95)
-    # p.add_argument("--start", type=int, default=0, help="Start index within transcripts list")
-    # p.add_argument("--limit", type=int, default=None, help="How many transcripts to process (for testing)")
-    # args = p.parse_args()
+            finished += 1
+            if finished % PROGRESS_EVERY == 0 or finished == len(jobs):
+                logger.info("Processed %d/%d transcripts...", finished, len(jobs))
+
+        if jobs and server_url:
+            complete_server(server_url, jobs, parallel, temperature, top_p, on_result)
+        elif jobs:
+            complete_local(get_llm(model_path, n_ctx, n_gpu_layers), jobs, temperature, top_p, on_result)
+
+    # Rebuild output from the checkpoint (transcripts without turns pass through unchanged)
+    done = load_checkpoint(checkpoint_path)
+    out_data = dict(data)
+    out_data["transcripts"] = [done.get(start + pos, tr) for pos, tr in enumerate(subset)]
+    out_data["naturalisation"] = {
+        "model_path": model_path,
+        "n_ctx": n_ctx,
+        "n_gpu_layers": n_gpu_layers,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "top_p": top_p,
+        "start": start,
+        "limit": limit,
+        "style": style,
+    }
+
+    save_yaml(out_path, out_data)
+    logger.info("Wrote naturalised YAML: %s", out_path)
+
+
+def main(inp, out, model, n_ctx=4096, n_gpu_layers=999, max_tokens=900, temp=0.35, top_p=0.95, start=0, limit=None,
+         server_url=None, parallel=8, resume=False, verbose=False):
+    # Progress goes through logging; basicConfig is a no-op if the caller already configured it
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # Only this script's debug output; httpx etc. stay at INFO
+    logger.setLevel(logging.DEBUG if verbose else logging.INFO)
 
     # Style you can tweak
     style = {
@@ -255,8 +531,43 @@ def main(inp, out, model, n_ctx=4096, n_gpu_layers=999, max_tokens=900, temp=0.3
         start=start,
         limit=limit,
         style=style,
+        server_url=server_url,
+        parallel=parallel,
+        resume=resume,
     )
 
 
 if __name__ == "__main__":
-    main(inp='data/transcripts.yaml', out='data/transcripts_naturalised.yaml', model='models/mistral-7b-instruct-v0.2.Q5_K_M.gguf')
\ No newline at end of file
+    p = argparse.ArgumentParser()
+    p.add_argument("--in", dest="inp", default="data/transcripts.yaml", help="Input YAML (generated transcripts)")
+    p.add_argument("--out", dest="out", default="data/transcripts_naturalised.yaml", help="Output YAML (naturalised transcripts)")
+    p.add_argument("--model", default="models/mistral-7b-instruct-v0.2.Q5_K_M.gguf", help="Path to Mistral GGUF")
+    p.add_argument("--n_ctx", type=int, default=4096)
+    p.add_argument("--n_gpu_layers", type=int, default=999, help="Use 999 to offload as many as possible (Metal)")
+    p.add_argument("--max_tokens", type=int, default=900)
+    p.add_argument("--temperature", type=float, default=0.35)
+    p.add_argument("--top_p", type=float, default=0.95)
+    p.add_argument("--start", type=int, default=0, help="Start index within transcripts list")
+    p.add_argument("--limit", type=int, default=None, help="How many transcripts to process (for testing)")
+    p.add_argument("--server_url", default=os.getenv("LLAMA_SERVER_URL"), help="llama-server base URL to batch through")
+    p.add_argument("--parallel", type=int, default=8, help="Requests in flight against --server_url")
+    p.add_argument("--resume", action="store_true", help="Skip transcripts already in <out>.jsonl from an earlier run")
+    p.add_argument("--verbose", action="store_true", help="Log every prompt and raw model output")
+    args = p.parse_args()
+
+    main(
+        inp=args.inp,
+        out=args.out,
+        model=args.model,
+        n_ctx=args.n_ctx,
+        n_gpu_layers=args.n_gpu_layers,
+        max_tokens=args.max_tokens,
+        temp=args.temperature,
+        top_p=args.top_p,
+        start=args.start,
+        limit=args.limit,
+        server_url=args.server_url,
+        parallel=args.parallel,
+        resume=args.resume,
+        verbose=args.verbose,
+    )
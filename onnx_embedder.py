@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import os
+import sys
+from typing import List, Sequence, Union
+
+import numpy as np
+
+
+DEFAULT_ONNX_MODEL_DIR = "models/minilm-onnx"
+
+
+class OnnxEmbedder:
+    """
+    Drop-in for the subset of SentenceTransformer.encode the query scripts use, backed by an
+    ONNX Runtime session over an exported (optionally int8-quantised) MiniLM.
+    Mean-pools last_hidden_state over the attention mask, like the sentence-transformers
+    pooling layer, so vectors match the ones already stored in Weaviate (up to quantisation noise).
+
+    Export once with:
+      optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 --optimize O3 models/minilm-onnx
+      optimum-cli onnxruntime quantize --avx2 --onnx_model models/minilm-onnx -o models/minilm-onnx
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 256):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError:
+            print(
+                "Missing dependency: onnxruntime / transformers\n"
+                "Install with:\n"
+                "  pip install -U onnxruntime transformers\n",
+                file=sys.stderr,
+            )
+            raise
+
+        # prefer the int8 model when it has been produced
+        model_file = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model_file):
+            model_file = os.path.join(model_dir, "model.onnx")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ort.InferenceSession(model_file, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.max_length = max_length
+
+    def encode(
+        self,
+        sentences: Union[str, Sequence[str]],
+        normalize_embeddings: bool = False,
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts: List[str] = [sentences] if single else list(sentences)
+
+        out: List[np.ndarray] = []
+        for i in range(0, len(texts), batch_size):
+            enc = self.tokenizer(
+                texts[i : i + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+            hidden = self.session.run(None, feeds)[0]  # last_hidden_state: (batch, seq, dim)
+
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out.append(pooled.astype(np.float32, copy=False))
+
+        vecs = np.concatenate(out) if out else np.empty((0, 0), dtype=np.float32)
+        return vecs[0] if single else vecs
+
+
+def get_embedder_onnx(model_dir: str = DEFAULT_ONNX_MODEL_DIR) -> OnnxEmbedder:
+    return OnnxEmbedder(model_dir)
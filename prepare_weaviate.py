@@ -4,6 +4,17 @@ from weaviate.connect import ConnectionParams
 from weaviate.classes.config import Configure, Property, DataType
 from sentence_transformers import SentenceTransformer
 
+from journeyworks_core import stamp_index_version
+
+_EMBEDDER = None
+
+
+def get_embedder() -> SentenceTransformer:
+    """Load the embedding model once per process (free, local)."""
+    global _EMBEDDER
+    if _EMBEDDER is None:
+        _EMBEDDER = SentenceTransformer("all-MiniLM-L6-v2")
+    return _EMBEDDER
 
 
 def main():
@@ -30,7 +41,7 @@ def main():
         col = client.collections.get("CustomerFeedback")
 
         # 2) Embedder (free, local)
-        embedder = SentenceTransformer("all-MiniLM-L6-v2")
+        embedder = get_embedder()
 
         # 3) Insert some mock data
         mock_feedback = [
@@ -54,10 +65,12 @@ def main():
             },
         ]
 
+        # One batched forward pass instead of one encode() per item
+        vecs = embedder.encode([item["text"] for item in mock_feedback], batch_size=64, convert_to_numpy=True)
         with col.batch.dynamic() as batch:
-            for item in mock_feedback:
-                vec = embedder.encode(item["text"]).tolist()
-                batch.add_object(properties=item, vector=vec)
+            for item, vec in zip(mock_feedback, vecs):
+                batch.add_object(properties=item, vector=vec.tolist())
+        stamp_index_version(col)  # invalidates semantic-cache entries for the old contents
 
         # 4) Query semantically
         query = "I'm angry my order arrived late"
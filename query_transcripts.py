@@ -2,51 +2,29 @@ from __future__ import annotations
 
 import argparse
 import os
-import sys
-from typing import Any, Dict, List, Optional
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import weaviate
-from weaviate.classes.init import Auth
+import numpy as np
 import weaviate.classes as wvc
 
-
-# ---------- Embeddings ----------
-def get_embedder(model_name: str):
-    try:
-        from sentence_transformers import SentenceTransformer
-    except ImportError:
-        print(
-            "Missing dependency: sentence-transformers\n"
-            "Install with:\n"
-            "  pip install -U sentence-transformers\n",
-            file=sys.stderr,
-        )
-        raise
-    return SentenceTransformer(model_name)
-
-
-def embed_query(embedder, text: str) -> List[float]:
-    vec = embedder.encode([text], normalize_embeddings=True, show_progress_bar=False)[0]
-    return vec.tolist()
+from journeyworks_core import (
+    DISTANCE_METADATA,
+    WeaviateSession,
+    clamp,
+    embed_query,
+    embedder_key,
+    equal_filters,
+    get_embedder,
+    get_session,
+    post_json,
+)
+from onnx_embedder import DEFAULT_ONNX_MODEL_DIR
+from semantic_cache import DEFAULT_SEMANTIC_CACHE_PATH, SemanticCache, to_hits
 
 
 # ---------- Weaviate ----------
-def connect_weaviate(host: str, port: int, grpc_port: int, api_key: Optional[str]):
-    if api_key:
-        client = weaviate.connect_to_local(
-            host=host,
-            port=port,
-            grpc_port=grpc_port,
-            auth_credentials=Auth.api_key(api_key),
-        )
-    else:
-        client = weaviate.connect_to_local(host=host, port=port, grpc_port=grpc_port)
-
-    if not client.is_ready():
-        raise RuntimeError("Weaviate is not ready (check container, ports, auth).")
-    return client
-
-
+@lru_cache(maxsize=256)
 def build_filters(
     journey_type: Optional[str],
     outcome: Optional[str],
@@ -55,36 +33,124 @@ def build_filters(
 ) -> Optional[wvc.query.Filter]:
     """
     Build an AND filter if any filter values are provided.
-    Properties must match what we indexed.
+    Memoised: the same filter combination reuses the same (immutable) Filter object.
     """
-    clauses: List[wvc.query.Filter] = []
-
-    if journey_type:
-        clauses.append(wvc.query.Filter.by_property("journey_type").equal(journey_type))
-    if outcome:
-        clauses.append(wvc.query.Filter.by_property("outcome").equal(outcome))
-    if sentiment:
-        clauses.append(wvc.query.Filter.by_property("sentiment").equal(sentiment))
-    if channel:
-        clauses.append(wvc.query.Filter.by_property("channel").equal(channel))
-
-    if not clauses:
-        return None
-    if len(clauses) == 1:
-        return clauses[0]
-
-    # AND them
-    f = clauses[0]
-    for c in clauses[1:]:
-        f = f & c
-    return f
+    return equal_filters(
+        (("journey_type", journey_type), ("outcome", outcome), ("sentiment", sentiment), ("channel", channel))
+    )
+
+
+# Properties returned for evidence display; turns_json (the bulk of each object) only with --show-turns
+RETURN_PROPS = [
+    "text",
+    "event_name",
+    "journey_type",
+    "sentiment",
+    "outcome",
+    "channel",
+    "naturalised_status",
+]
+RETURN_PROPS_WITH_TURNS = RETURN_PROPS + ["turns_json"]
+
+
+def retrieve(
+    embedder,
+    session_factory: Callable[[], WeaviateSession],
+    q: str,
+    k: int,
+    collection: str,
+    embed_model: str,
+    journey_type: Optional[str] = None,
+    outcome: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    channel: Optional[str] = None,
+    cache: Optional[SemanticCache] = None,
+    qvec: Optional[np.ndarray] = None,
+    show_turns: bool = False,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Embed q (unless qvec is already given) and return (hits, from_cache).
+    A cache hit only reads the collection's index stamp (at most every INDEX_VERSION_TTL
+    seconds), not the vectors. turns_json is only fetched when show_turns is set.
+    """
+    if qvec is None:
+        qvec = embed_query(embedder, q)
+
+    sess = session_factory()
+    hits = None
+    if cache is not None:
+        # Cached hits are only reused for the same query shape, endpoint, embedder and index contents
+        scope = "|".join(
+            str(v)
+            for v in (
+                "query_transcripts",
+                sess.endpoint,
+                collection,
+                sess.index_version(collection),
+                k,
+                embed_model,
+                journey_type,
+                outcome,
+                sentiment,
+                channel,
+                show_turns,
+            )
+        )
+        hits = cache.lookup(scope, qvec)
+    if hits is not None:
+        cache.save()  # also persists the centroid update on a hit
+        return hits, True
+
+    col = sess.collection(collection)
+    res = col.query.near_vector(
+        near_vector=qvec,
+        limit=k,
+        filters=build_filters(journey_type, outcome, sentiment, channel),
+        return_properties=RETURN_PROPS_WITH_TURNS if show_turns else RETURN_PROPS,
+        return_metadata=DISTANCE_METADATA,
+    )
+
+    hits = to_hits(res.objects)
+    if cache is not None and hits:
+        cache.insert(scope, qvec, hits)
+        cache.save()
+    return hits, False
+
+
+def trim_hits(hits: List[Dict[str, Any]], snippet_len: int) -> List[Dict[str, Any]]:
+    """Copies of hits with text clamped to snippet_len (the originals may be cache payloads)."""
+    return [
+        {**hit, "properties": {**hit["properties"], "text": clamp(hit["properties"].get("text", ""), snippet_len)}}
+        for hit in hits
+    ]
+
+
+def print_hits(hits: List[Dict[str, Any]], show_turns: bool, snippet_len: int = 400) -> None:
+    print("\n--- RESULTS ---")
+    for i, hit in enumerate(hits, start=1):
+        dist = hit["distance"]
+        props = hit["properties"]
+
+        # Weaviate returns distance (lower is better) when requested.
+        dist_s = f"{dist:.4f}" if isinstance(dist, (int, float)) else "n/a"
+
+        print(f"\n#{i}  distance={dist_s}  uuid={hit['uuid']}")
+        print(
+            f"  event={props.get('event_name','')!s} | "
+            f"journey={props.get('journey_type','')!s} | "
+            f"outcome={props.get('outcome','')!s} | "
+            f"sentiment={props.get('sentiment','')!s} | "
+            f"channel={props.get('channel','')!s}"
+        )
+        print(f"  naturalised_status={props.get('naturalised_status','')!s}")
 
+        text = props.get("text", "")
+        print("  snippet:", clamp(text, snippet_len))
 
-def clamp(s: str, n: int) -> str:
-    s = (s or "").strip()
-    if len(s) <= n:
-        return s
-    return s[: n - 1].rstrip() + "…"
+        if show_turns:
+            turns_json = props.get("turns_json", "")
+            if turns_json:
+                print("  turns_json:", clamp(turns_json, 1200))
 
 
 def main():
@@ -97,82 +163,79 @@ def main():
     p.add_argument("--grpc-port", type=int, default=int(os.getenv("WEAVIATE_GRPC_PORT", "50051")))
     p.add_argument("--api-key", default=os.getenv("WEAVIATE_API_KEY"))
     p.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    p.add_argument("--embed-backend", choices=["torch", "onnx"], default=os.getenv("EMBED_BACKEND", "torch"))
+    p.add_argument("--onnx-dir", default=os.getenv("ONNX_EMBED_DIR", DEFAULT_ONNX_MODEL_DIR), help="ONNX export used by --embed-backend onnx")
     p.add_argument("--journey-type", default=None)
     p.add_argument("--outcome", default=None)
     p.add_argument("--sentiment", default=None)
     p.add_argument("--channel", default=None)
-    p.add_argument("--show-turns", action="store_true", help="Print stored turns_json (can be long)")
+    p.add_argument("--show-turns", action="store_true", help="Fetch and print stored turns_json (can be long)")
+    p.add_argument("--snippet-len", type=int, default=400, help="Characters of text to show per result")
+    p.add_argument(
+        "--semantic-cache",
+        nargs="?",
+        const=DEFAULT_SEMANTIC_CACHE_PATH,
+        default=None,
+        help=f"Reuse results of similar earlier questions, stored in this file (default {DEFAULT_SEMANTIC_CACHE_PATH}); off unless given",
+    )
+    p.add_argument("--cache-threshold", type=float, default=0.86, help="Cosine similarity needed to reuse cached results")
+    p.add_argument(
+        "--server",
+        default=os.getenv("JOURNEYWORKS_SERVER"),
+        help="URL of a running rag_server.py (e.g. http://127.0.0.1:8000); models stay loaded there between queries",
+    )
     args = p.parse_args()
 
-    print(f"Embedding model: {args.embed_model}")
-    embedder = get_embedder(args.embed_model)
-    qvec = embed_query(embedder, args.q)
-
-    print(f"Connecting to Weaviate at http://{args.host}:{args.port} (gRPC {args.grpc_port})")
-    client = connect_weaviate(args.host, args.port, args.grpc_port, args.api_key)
-
-    try:
-        if not client.collections.exists(args.collection):
-            raise RuntimeError(f"Collection '{args.collection}' does not exist. Run index_transcripts.py first.")
-
-        col = client.collections.get(args.collection)
-
-        where = build_filters(args.journey_type, args.outcome, args.sentiment, args.channel)
-
-        # Return these properties for evidence display
-        props = [
-            "text",
-            "event_name",
-            "journey_type",
-            "sentiment",
-            "outcome",
-            "channel",
-            "naturalised_status",
-            "turns_json",
-        ]
-
-        res = col.query.near_vector(
-            near_vector=qvec,
-            limit=args.k,
-            filters=where,
-            return_properties=props,
-            return_metadata=wvc.query.MetadataQuery(distance=True),
+    filters = {
+        "journey_type": args.journey_type,
+        "outcome": args.outcome,
+        "sentiment": args.sentiment,
+        "channel": args.channel,
+    }
+
+    if args.server:
+        resp = post_json(
+            args.server.rstrip("/") + "/retrieve",
+            {
+                "q": args.q,
+                "k": args.k,
+                "collection": args.collection,
+                "show_turns": args.show_turns,
+                "snippet_len": args.snippet_len,
+                **filters,
+            },
+        )
+        hits, cached = resp["hits"], resp["cached"]
+    else:
+        print(f"Embedding model: {args.embed_model}")
+        embedder = get_embedder(args.embed_model, args.embed_backend, args.onnx_dir)
+        cache = SemanticCache(args.semantic_cache, threshold=args.cache_threshold) if args.semantic_cache else None
+
+        def session() -> WeaviateSession:
+            sess = get_session(args.host, args.port, args.grpc_port, args.api_key)
+            if not sess.connected:
+                print(f"Connecting to Weaviate at http://{args.host}:{args.port} (gRPC {args.grpc_port})")
+            return sess
+
+        hits, cached = retrieve(
+            embedder,
+            session,
+            args.q,
+            args.k,
+            args.collection,
+            embedder_key(args.embed_model, args.embed_backend, args.onnx_dir),
+            cache=cache,
+            show_turns=args.show_turns,
+            **filters,
         )
 
-        objs = res.objects or []
-        if not objs:
-            print("No results.")
-            return
-
-        print("\n--- RESULTS ---")
-        for i, obj in enumerate(objs, start=1):
-            md = obj.metadata
-            dist = getattr(md, "distance", None)
-            props = obj.properties or {}
-
-            # Weaviate returns distance (lower is better) when requested.
-            dist_s = f"{dist:.4f}" if isinstance(dist, (int, float)) else "n/a"
-
-            print(f"\n#{i}  distance={dist_s}  uuid={obj.uuid}")
-            print(
-                f"  event={props.get('event_name','')!s} | "
-                f"journey={props.get('journey_type','')!s} | "
-                f"outcome={props.get('outcome','')!s} | "
-                f"sentiment={props.get('sentiment','')!s} | "
-                f"channel={props.get('channel','')!s}"
-            )
-            print(f"  naturalised_status={props.get('naturalised_status','')!s}")
-
-            text = props.get("text", "")
-            print("  snippet:", clamp(text, 400))
-
-            if args.show_turns:
-                turns_json = props.get("turns_json", "")
-                if turns_json:
-                    print("  turns_json:", clamp(turns_json, 1200))
+    if cached:
+        print("Semantic cache hit: reusing results of a similar earlier question")
+    if not hits:
+        print("No results.")
+        return
 
-    finally:
-        client.close()
+    print_hits(hits, args.show_turns, args.snippet_len)
 
 
 if __name__ == "__main__":
@@ -1,62 +1,35 @@
 from __future__ import annotations
 
 import argparse
+import json
 import os
 import re
 import sys
-from typing import Any, Dict, List, Optional, Tuple
+import urllib.request
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-import weaviate
+import numpy as np
 import weaviate.classes as wvc
-from weaviate.classes.init import Auth
 
 from llama_cpp import Llama
 
-
-# ---------- Embeddings ----------
-def get_embedder(model_name: str):
-    try:
-        from sentence_transformers import SentenceTransformer
-    except ImportError:
-        print(
-            "Missing dependency: sentence-transformers\n"
-            "Install with:\n"
-            "  pip install -U sentence-transformers\n",
-            file=sys.stderr,
-        )
-        raise
-    return SentenceTransformer(model_name)
-
-
-def embed_query(embedder, text: str) -> List[float]:
-    vec = embedder.encode([text], normalize_embeddings=True, show_progress_bar=False)[0]
-    return vec.tolist()
+from journeyworks_core import (
+    DISTANCE_METADATA,
+    WeaviateSession,
+    clamp,
+    embed_query,
+    embedder_key,
+    equal_filters,
+    get_embedder,
+    get_session,
+)
+from onnx_embedder import DEFAULT_ONNX_MODEL_DIR
+from semantic_cache import DEFAULT_SEMANTIC_CACHE_PATH, SemanticCache, to_hits
 
 
 # ---------- Weaviate ----------
-def connect_weaviate(host: str, port: int, grpc_port: int, api_key: Optional[str]):
-    if api_key:
-        client = weaviate.connect_to_local(
-            host=host,
-            port=port,
-            grpc_port=grpc_port,
-            auth_credentials=Auth.api_key(api_key),
-        )
-    else:
-        client = weaviate.connect_to_local(host=host, port=port, grpc_port=grpc_port)
-
-    if not client.is_ready():
-        raise RuntimeError("Weaviate is not ready (check container, ports, auth).")
-    return client
-
-
-def clamp(s: str, n: int) -> str:
-    s = (s or "").strip()
-    if len(s) <= n:
-        return s
-    return s[: n - 1].rstrip() + "…"
-
-
+@lru_cache(maxsize=256)  # same filter combination -> same (immutable) Filter object
 def build_filters(
     require_naturalised_ok: bool,
     journey_type: Optional[str],
@@ -64,29 +37,35 @@ def build_filters(
     sentiment: Optional[str],
     channel: Optional[str],
 ) -> Optional[wvc.query.Filter]:
-    clauses: List[wvc.query.Filter] = []
+    return equal_filters(
+        (
+            ("naturalised_status", "ok" if require_naturalised_ok else None),
+            ("journey_type", journey_type),
+            ("outcome", outcome),
+            ("sentiment", sentiment),
+            ("channel", channel),
+        )
+    )
 
-    if require_naturalised_ok:
-        clauses.append(wvc.query.Filter.by_property("naturalised_status").equal("ok"))
 
-    if journey_type:
-        clauses.append(wvc.query.Filter.by_property("journey_type").equal(journey_type))
-    if outcome:
-        clauses.append(wvc.query.Filter.by_property("outcome").equal(outcome))
-    if sentiment:
-        clauses.append(wvc.query.Filter.by_property("sentiment").equal(sentiment))
-    if channel:
-        clauses.append(wvc.query.Filter.by_property("channel").equal(channel))
+# ---------- Prompting ----------
+RULES = """
+You are assisting a bank executive with insights from customer contact transcripts.
+Rules:
+- Answer the QUESTION using ONLY the EVIDENCE provided.
+- If the evidence is insufficient, say exactly what is missing and what you would check next.
+- Keep it concise, executive-friendly.
+- Provide 3 sections:
+  1) Key findings (bullets)
+  2) What this suggests we should do (bullets)
+  3) Evidence references: cite which evidence items support each point (e.g., [E1], [E2])
+- Do NOT invent numbers or facts.
+""".strip()
 
-    if not clauses:
-        return None
-    f = clauses[0]
-    for c in clauses[1:]:
-        f = f & c
-    return f
+# Every RAG prompt starts with this, so llama.cpp can keep its tokens in the KV cache
+RAG_PROMPT_PREFIX = f"[INST]\n{RULES}\n\n"
 
 
-# ---------- Prompting ----------
 def make_rag_prompt(question: str, evidences: List[Dict[str, Any]]) -> str:
     """
     Evidence-grounded prompt. We cite evidence as [E1], [E2], ...
@@ -102,23 +81,7 @@ def make_rag_prompt(question: str, evidences: List[Dict[str, Any]]) -> str:
         )
     evidence_text = "\n\n".join(evidence_blocks)
 
-    rules = """
-You are assisting a bank executive with insights from customer contact transcripts.
-Rules:
-- Answer the QUESTION using ONLY the EVIDENCE provided.
-- If the evidence is insufficient, say exactly what is missing and what you would check next.
-- Keep it concise, executive-friendly.
-- Provide 3 sections:
-  1) Key findings (bullets)
-  2) What this suggests we should do (bullets)
-  3) Evidence references: cite which evidence items support each point (e.g., [E1], [E2])
-- Do NOT invent numbers or facts.
-""".strip()
-
-    return f"""[INST]
-{rules}
-
-QUESTION:
+    return f"""{RAG_PROMPT_PREFIX}QUESTION:
 {question}
 
 EVIDENCE:
@@ -126,10 +89,184 @@ EVIDENCE:
 [/INST]"""
 
 
+EVIDENCE_PROPS = ["text", "event_name", "journey_type", "sentiment", "outcome", "channel", "naturalised_status"]
+
+
+def retrieve_evidence(
+    embedder,
+    session_factory: Callable[[], WeaviateSession],
+    q: str,
+    k: int,
+    collection: str,
+    embed_model: str,
+    require_naturalised_ok: bool = False,
+    journey_type: Optional[str] = None,
+    outcome: Optional[str] = None,
+    sentiment: Optional[str] = None,
+    channel: Optional[str] = None,
+    cache: Optional[SemanticCache] = None,
+    qvec: Optional[np.ndarray] = None,
+    snippet_len: int = 900,
+) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Embed q (unless qvec is already given) and return (evidences, from_cache), reusing the hits
+    of a similar earlier question with the same filters when cached. A cache hit only reads the
+    collection's index stamp, not the vectors.
+    """
+    if qvec is None:
+        qvec = embed_query(embedder, q)
+
+    sess = session_factory()
+    hits = None
+    if cache is not None:
+        scope = "|".join(
+            str(v)
+            for v in (
+                "rag_answer_with_mistral",
+                sess.endpoint,
+                collection,
+                sess.index_version(collection),
+                k,
+                embed_model,
+                require_naturalised_ok,
+                journey_type,
+                outcome,
+                sentiment,
+                channel,
+            )
+        )
+        hits = cache.lookup(scope, qvec)
+    from_cache = hits is not None
+
+    if hits is None:
+        col = sess.collection(collection)
+        where = build_filters(require_naturalised_ok, journey_type, outcome, sentiment, channel)
+        res = col.query.near_vector(
+            near_vector=qvec,
+            limit=k,
+            filters=where,
+            return_properties=EVIDENCE_PROPS,
+            return_metadata=DISTANCE_METADATA,
+        )
+
+        hits = to_hits(res.objects)
+        if cache is not None and hits:
+            cache.insert(scope, qvec, hits)
+
+    if cache is not None:
+        cache.save()  # also persists the centroid update on a hit
+
+    evidences: List[Dict[str, Any]] = []
+    for hit in hits:
+        pr = hit["properties"]
+        txt = pr.get("text", "") or ""
+        evidences.append(
+            {
+                "meta": {
+                    "event_name": pr.get("event_name", ""),
+                    "journey_type": pr.get("journey_type", ""),
+                    "sentiment": pr.get("sentiment", ""),
+                    "outcome": pr.get("outcome", ""),
+                    "channel": pr.get("channel", ""),
+                    "naturalised_status": pr.get("naturalised_status", ""),
+                    "uuid": hit["uuid"],
+                },
+                # keep evidence reasonably short to fit context
+                "snippet": clamp(txt, snippet_len),
+            }
+        )
+    return evidences, from_cache
+
+
+def answer_question(
+    llm: Llama,
+    question: str,
+    evidences: List[Dict[str, Any]],
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> str:
+    prompt = make_rag_prompt(question, evidences)
+    out = llm(
+        prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stop=["</s>", "[INST]"],
+    )
+    return out["choices"][0]["text"].strip()
+
+
+def stream_answer(
+    llm: Llama,
+    question: str,
+    evidences: List[Dict[str, Any]],
+    max_tokens: int,
+    temperature: float,
+    top_p: float,
+) -> Iterator[str]:
+    """Like answer_question, but yields the answer text piece by piece as it is generated."""
+    prompt = make_rag_prompt(question, evidences)
+    started = False
+    for chunk in llm(
+        prompt,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        top_p=top_p,
+        stop=["</s>", "[INST]"],
+        stream=True,
+    ):
+        text = chunk["choices"][0]["text"]
+        if not started:
+            text = text.lstrip()
+            if not text:
+                continue
+            started = True
+        yield text
+
+
+def print_streamed_answer(pieces: Iterable[str]) -> str:
+    """Print answer text as it arrives and return the full answer."""
+    print("\n=== ANSWER ===\n")
+    answer: List[str] = []
+    for text in pieces:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        answer.append(text)
+    print()
+    return "".join(answer).strip()
+
+
+def print_evidence_list(evidences: List[Dict[str, Any]]) -> None:
+    print("\n=== EVIDENCE LIST (for UI / debugging) ===\n")
+    for i, ev in enumerate(evidences, start=1):
+        m = ev["meta"]
+        print(f"[E{i}] uuid={m['uuid']} naturalised={m['naturalised_status']} event={m['event_name']} journey={m['journey_type']} outcome={m['outcome']} sentiment={m['sentiment']}")
+
+
+def post_sse(url: str, payload: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """POST payload to a rag_server.py streaming endpoint and yield its (event, data) pairs."""
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode("utf-8"),
+        headers={"Content-Type": "application/json", "Accept": "text/event-stream"},
+    )
+    with urllib.request.urlopen(req) as resp:
+        event = "message"
+        for raw in resp:
+            line = raw.decode("utf-8").rstrip("\r\n")
+            if line.startswith("event:"):
+                event = line[len("event:") :].strip()
+            elif line.startswith("data:"):
+                yield event, json.loads(line[len("data:") :])
+                event = "message"
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument("--q", required=True, help="Question")
     p.add_argument("--k", type=int, default=5, help="Top-k evidence to retrieve")
+    p.add_argument("--snippet-len", type=int, default=900, help="Characters of each evidence text given to Mistral")
     p.add_argument("--collection", default="JourneyWorksTranscript")
 
     # Weaviate defaults
@@ -140,11 +277,15 @@ def main():
 
     # Embeddings
     p.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    p.add_argument("--embed-backend", choices=["torch", "onnx"], default=os.getenv("EMBED_BACKEND", "torch"))
+    p.add_argument("--onnx-dir", default=os.getenv("ONNX_EMBED_DIR", DEFAULT_ONNX_MODEL_DIR), help="ONNX export used by --embed-backend onnx")
 
     # Mistral GGUF (llama.cpp)
-    p.add_argument("--mistral-model", default=os.getenv("MISTRAL_GGUF", "models/mistral-7b-instruct-v0.2.Q5_K_M.gguf"))
+    p.add_argument("--mistral-model", default=os.getenv("MISTRAL_GGUF", "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf"))
     p.add_argument("--n-ctx", type=int, default=4096)
     p.add_argument("--n-gpu-layers", type=int, default=999)
+    p.add_argument("--n-threads", type=int, default=min(16, os.cpu_count() or 8))
+    p.add_argument("--n-batch", type=int, default=2048, help="Prompt tokens per llama_decode call (prefill)")
     p.add_argument("--max-tokens", type=int, default=600)
     p.add_argument("--temp", type=float, default=0.2)
     p.add_argument("--top-p", type=float, default=0.95)
@@ -156,92 +297,95 @@ def main():
     p.add_argument("--sentiment", default=None)
     p.add_argument("--channel", default=None)
 
-    args = p.parse_args()
-    print("rag_answer_with_mistral.py: starting", file=sys.stderr, flush=True)
+    # Reuse retrieval results of similar earlier questions
+    p.add_argument(
+        "--semantic-cache",
+        nargs="?",
+        const=DEFAULT_SEMANTIC_CACHE_PATH,
+        default=None,
+        help=f"Cache file (default {DEFAULT_SEMANTIC_CACHE_PATH}); off unless given",
+    )
+    p.add_argument("--cache-threshold", type=float, default=0.86, help="Cosine similarity needed to reuse cached evidence")
 
-    # Embed the question
-    embedder = get_embedder(args.embed_model)
-    qvec = embed_query(embedder, args.q)
+    p.add_argument(
+        "--server",
+        default=os.getenv("JOURNEYWORKS_SERVER"),
+        help="URL of a running rag_server.py (e.g. http://127.0.0.1:8000); models stay loaded there between questions",
+    )
 
-    # Retrieve evidence
-    client = connect_weaviate(args.host, args.port, args.grpc_port, args.api_key)
-    try:
-        if not client.collections.exists(args.collection):
-            raise RuntimeError(f"Collection '{args.collection}' does not exist.")
-
-        col = client.collections.get(args.collection)
-        where = build_filters(
-            args.require_naturalised_ok,
-            args.journey_type,
-            args.outcome,
-            args.sentiment,
-            args.channel,
-        )
+    args = p.parse_args()
+    print("rag_answer_with_mistral.py: starting", file=sys.stderr, flush=True)
 
-        props = ["text", "event_name", "journey_type", "sentiment", "outcome", "channel", "naturalised_status"]
-        res = col.query.near_vector(
-            near_vector=qvec,
-            limit=args.k,
-            filters=where,
-            return_properties=props,
-            return_metadata=wvc.query.MetadataQuery(distance=True),
+    filters = {
+        "require_naturalised_ok": args.require_naturalised_ok,
+        "journey_type": args.journey_type,
+        "outcome": args.outcome,
+        "sentiment": args.sentiment,
+        "channel": args.channel,
+    }
+
+    if args.server:
+        events = post_sse(
+            args.server.rstrip("/") + "/ask/stream",
+            {
+                "q": args.q,
+                "k": args.k,
+                "collection": args.collection,
+                "snippet_len": args.snippet_len,
+                "max_tokens": args.max_tokens,
+                "temp": args.temp,
+                "top_p": args.top_p,
+                **filters,
+            },
         )
-        objs = res.objects or []
-        if not objs:
+        # the server sends the evidence first, then the answer token by token
+        _, first = next(events)
+        if not first["evidence"]:
             print("No results from Weaviate.")
             return
+        print_streamed_answer(data["text"] for event, data in events if event == "token")
+        print_evidence_list(first["evidence"])
+        return
+
+    # Embed the question and retrieve evidence
+    embedder = get_embedder(args.embed_model, args.embed_backend, args.onnx_dir)
+    cache = SemanticCache(args.semantic_cache, threshold=args.cache_threshold) if args.semantic_cache else None
+
+    evidences, from_cache = retrieve_evidence(
+        embedder,
+        lambda: get_session(args.host, args.port, args.grpc_port, args.api_key),
+        args.q,
+        args.k,
+        args.collection,
+        embedder_key(args.embed_model, args.embed_backend, args.onnx_dir),
+        cache=cache,
+        snippet_len=args.snippet_len,
+        **filters,
+    )
 
-        evidences: List[Dict[str, Any]] = []
-        for obj in objs:
-            pr = obj.properties or {}
-            txt = pr.get("text", "") or ""
-            evidences.append(
-                {
-                    "meta": {
-                        "event_name": pr.get("event_name", ""),
-                        "journey_type": pr.get("journey_type", ""),
-                        "sentiment": pr.get("sentiment", ""),
-                        "outcome": pr.get("outcome", ""),
-                        "channel": pr.get("channel", ""),
-                        "naturalised_status": pr.get("naturalised_status", ""),
-                        "uuid": str(obj.uuid),
-                    },
-                    # keep evidence reasonably short to fit context
-                    "snippet": clamp(txt, 900),
-                }
-            )
-    finally:
-        client.close()
-
-    # Build grounded prompt
-    prompt = make_rag_prompt(args.q, evidences)
+    if from_cache:
+        print("Semantic cache hit: reusing evidence of a similar earlier question", file=sys.stderr)
+    if not evidences:
+        print("No results from Weaviate.")
+        return
 
     # Run Mistral
     llm = Llama(
         model_path=args.mistral_model,
         n_ctx=args.n_ctx,
         n_gpu_layers=args.n_gpu_layers,
+        n_threads=args.n_threads,
+        n_threads_batch=args.n_threads,
+        n_batch=args.n_batch,
+        n_ubatch=min(512, args.n_batch),
         verbose=False,
     )
     try:
-        out = llm(
-            prompt,
-            max_tokens=args.max_tokens,
-            temperature=args.temp,
-            top_p=args.top_p,
-            stop=["</s>", "[INST]"],
-        )
-        answer = out["choices"][0]["text"].strip()
+        print_streamed_answer(stream_answer(llm, args.q, evidences, args.max_tokens, args.temp, args.top_p))
     finally:
         llm.close()
 
-    print("\n=== ANSWER ===\n")
-    print(answer)
-
-    print("\n=== EVIDENCE LIST (for UI / debugging) ===\n")
-    for i, ev in enumerate(evidences, start=1):
-        m = ev["meta"]
-        print(f"[E{i}] uuid={m['uuid']} naturalised={m['naturalised_status']} event={m['event_name']} journey={m['journey_type']} outcome={m['outcome']} sentiment={m['sentiment']}")
+    print_evidence_list(evidences)
 
 if __name__ == "__main__":
     main()
@@ -249,4 +393,4 @@ if __name__ == "__main__":
 
     """
     --q "What are customers disputing about mortgage rate increases, and why does it escalate?"  --k 5 --require-naturalised-ok
-    """
\ No newline at end of file
+    """
@@ -1,30 +1,40 @@
 from __future__ import annotations
 
+import argparse
 import os
-from typing import List, Dict, Any
+import sys
+from typing import List, Dict, Any, Optional
 
-import weaviate
-from weaviate.connect import ConnectionParams
-from sentence_transformers import SentenceTransformer
 from llama_cpp import Llama
 
+from journeyworks_core import WeaviateSession, embed_query, get_embedder, get_session
+from semantic_cache import DEFAULT_SEMANTIC_CACHE_PATH, SemanticCache, to_hits
+
 
 # ---------- Config ----------
-WEAVIATE_HTTP_URL = "http://localhost:8080"
+WEAVIATE_HOST = "localhost"
+WEAVIATE_PORT = 8080
 WEAVIATE_GRPC_PORT = 50051
 COLLECTION = "CustomerFeedback"
 
 EMBED_MODEL = "all-MiniLM-L6-v2"
 
 # Point this at your downloaded GGUF
-MISTRAL_GGUF_PATH = "models/mistral-7b-instruct-v0.2.Q5_K_M.gguf"
+MISTRAL_GGUF_PATH = "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf"
 
 # Context window: increase if you have RAM (4096+ is nice; 2048 is fine)
 N_CTX = 4096
 
+# CPU threads and prompt batch size for llama.cpp (bigger batches speed up the prefill)
+N_THREADS = min(16, os.cpu_count() or 8)
+N_BATCH = 2048
+N_UBATCH = 512
+
 # How many matches to retrieve from Weaviate
 TOP_K = 6
 
+RETURN_PROPS = ["text", "source", "sentiment", "journey_stage"]
+
 
 # ---------- RAG helpers ----------
 def build_context_snippets(objs: List[Dict[str, Any]]) -> str:
@@ -43,98 +53,137 @@ def build_context_snippets(objs: List[Dict[str, Any]]) -> str:
     return "\n".join(lines)
 
 
+SYSTEM_RULES = (
+    "You are a customer insights assistant.\n"
+    "Use ONLY the provided CONTEXT.\n"
+    "Answer in plain text.\n"
+    "Do NOT include headings like 'Summary' or 'Overview'.\n"
+    "Do NOT mention that you used context or documents.\n"
+    "If the context is insufficient, say: 'Not enough information in the data.'\n"
+)
+
+
 def make_mistral_inst_prompt(question: str, context: str) -> str:
     """
     Mistral Instruct expects [INST] ... [/INST] format.
     This prompt pushes it to output only plain text, no meta, no summary section.
     """
-    system_rules = (
-        "You are a customer insights assistant.\n"
-        "Use ONLY the provided CONTEXT.\n"
-        "Answer in plain text.\n"
-        "Do NOT include headings like 'Summary' or 'Overview'.\n"
-        "Do NOT mention that you used context or documents.\n"
-        "If the context is insufficient, say: 'Not enough information in the data.'\n"
-    )
-
     return (
-        f"[INST] {system_rules}\n"
+        f"[INST] {SYSTEM_RULES}\n"
         f"CONTEXT:\n{context}\n\n"
         f"QUESTION:\n{question}\n\n"
         f"Answer plainly. [/INST]"
     )
 
 
-def query_weaviate(client: weaviate.WeaviateClient, embedder: SentenceTransformer, question: str, top_k: int):
-    col = client.collections.get(COLLECTION)
-
-    qvec = embedder.encode(question).tolist()
-
+def query_weaviate(
+    session: WeaviateSession,
+    embedder,
+    question: str,
+    top_k: int,
+    cache: Optional[SemanticCache] = None,
+):
+    qvec = embed_query(embedder, question)
+
+    # Similar earlier questions reuse their hits instead of querying Weaviate again;
+    # the index stamp changes whenever prepare_weaviate.py re-seeds the collection
+    if cache is not None:
+        scope = f"rag_local|{session.endpoint}|{COLLECTION}|{session.index_version(COLLECTION)}|{top_k}|{EMBED_MODEL}"
+        hits = cache.lookup(scope, qvec)
+        if hits is not None:
+            cache.save()  # persist the centroid update
+            return [h["properties"] for h in hits]
+
+    col = session.collection(COLLECTION)
     res = col.query.near_vector(
         near_vector=qvec,
         limit=top_k,
-        return_properties=["text", "source", "sentiment", "journey_stage"],
+        return_properties=RETURN_PROPS,
     )
 
+    hits = to_hits(res.objects)
+    if cache is not None and hits:
+        cache.insert(scope, qvec, hits)
+        cache.save()
+
     # v4 returns objects; pull out properties dicts
-    return [obj.properties for obj in res.objects]
+    return [h["properties"] for h in hits]
 
 
 def generate_answer(llm: Llama, prompt: str) -> str:
     """
     llama-cpp-python completion call. Use stop tokens to avoid rambly continuations.
+    Tokens are printed as they are generated; the full answer is returned.
     """
-    out = llm(
+    pieces: List[str] = []
+    for chunk in llm(
         prompt,
         max_tokens=400,
         temperature=0.2,
         top_p=0.95,
         # Stops: end of turn + avoid the model starting a new instruction
         stop=["</s>", "[INST]"],
-    )
-    return out["choices"][0]["text"].strip()
+        stream=True,
+    ):
+        text = chunk["choices"][0]["text"]
+        if not pieces:
+            text = text.lstrip()
+            if not text:
+                continue
+        sys.stdout.write(text)
+        sys.stdout.flush()
+        pieces.append(text)
+    print()
+    return "".join(pieces).strip()
 
 
 def main():
-    # 1) Connect Weaviate (v4) safely
-    client = weaviate.WeaviateClient(
-        connection_params=ConnectionParams.from_url(WEAVIATE_HTTP_URL, grpc_port=WEAVIATE_GRPC_PORT)
+    p = argparse.ArgumentParser(description="Answer a fixed question over CustomerFeedback with Mistral.")
+    p.add_argument(
+        "--semantic-cache",
+        nargs="?",
+        const=DEFAULT_SEMANTIC_CACHE_PATH,
+        default=None,
+        help=f"Reuse hits of similar earlier questions, stored in this file (default {DEFAULT_SEMANTIC_CACHE_PATH}); off unless given",
+    )
+    args = p.parse_args()
+
+    # 1) Connect Weaviate (v4) safely; the session is reused and closed at exit
+    session = get_session(WEAVIATE_HOST, WEAVIATE_PORT, WEAVIATE_GRPC_PORT)
+    session.connect()
+
+    # 2) Load embedding model (local)
+    embedder = get_embedder(EMBED_MODEL)
+
+    # 3) Load Mistral (local)
+    llm = Llama(
+        model_path=MISTRAL_GGUF_PATH,
+        n_ctx=N_CTX,
+        # If you compiled/installed with Metal support, this usually helps:
+        # n_gpu_layers=-1,  # uncomment if your build supports it
+        n_gpu_layers=999,
+        n_threads=N_THREADS,
+        n_threads_batch=N_THREADS,
+        n_batch=N_BATCH,
+        n_ubatch=N_UBATCH,
+        verbose=True,
     )
 
     try:
-        client.connect()
-        if not client.is_ready():
-            raise RuntimeError("Weaviate is not ready. Is Docker container running and ports exposed?")
-
-        # 2) Load embedding model (local)
-        embedder = SentenceTransformer(EMBED_MODEL)
-
-        # 3) Load Mistral (local)
-        llm = Llama(
-            model_path=MISTRAL_GGUF_PATH,
-            n_ctx=N_CTX,
-            # If you compiled/installed with Metal support, this usually helps:
-            # n_gpu_layers=-1,  # uncomment if your build supports it
-            n_gpu_layers=999,
-            verbose=True,
-        )
-
         # 4) Ask a question (replace with your own)
         question = "What are the main customer pain points in the data, and what should support fix first?"
 
         # Retrieve
-        hits = query_weaviate(client, embedder, question, TOP_K)
+        cache = SemanticCache(args.semantic_cache) if args.semantic_cache else None
+        hits = query_weaviate(session, embedder, question, TOP_K, cache=cache)
         context = build_context_snippets(hits)
 
         # Generate
         prompt = make_mistral_inst_prompt(question, context)
-        answer = generate_answer(llm, prompt)
-
         print("\n--- ANSWER ---\n")
-        print(answer)
+        generate_answer(llm, prompt)
 
     finally:
-        client.close()
         llm.close()
 
 
@@ -0,0 +1,412 @@
+"""
+Long-running JourneyWorks server: loads the embedder, Weaviate client and Mistral once and keeps
+them resident, so each question costs a retrieval (+ generation) instead of a cold start.
+
+  python rag_server.py            # or: uvicorn rag_server:app --port 8000
+
+query_transcripts.py / rag_answer_with_mistral.py forward to it with --server http://127.0.0.1:8000
+(or JOURNEYWORKS_SERVER). Settings come from the same environment variables as the CLIs.
+The react_rag_demo.py ReAct loop is served from POST /react/plan and /react/answer.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from llama_cpp import Llama, LlamaRAMCache
+from pydantic import BaseModel
+
+import query_transcripts
+import rag_answer_with_mistral
+import react_rag_demo
+from journeyworks_core import WeaviateSession, embedder_key, get_embedder
+from onnx_embedder import DEFAULT_ONNX_MODEL_DIR
+from semantic_cache import SemanticCache
+
+
+# ---------- Config ----------
+WEAVIATE_HOST = os.getenv("WEAVIATE_HOST", "localhost")
+WEAVIATE_PORT = int(os.getenv("WEAVIATE_PORT", "8080"))
+WEAVIATE_GRPC_PORT = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
+WEAVIATE_API_KEY = os.getenv("WEAVIATE_API_KEY")
+
+EMBED_MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+ONNX_EMBED_DIR = os.getenv("ONNX_EMBED_DIR", DEFAULT_ONNX_MODEL_DIR)
+
+MISTRAL_GGUF = os.getenv("MISTRAL_GGUF", "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf")
+N_CTX = int(os.getenv("N_CTX", "4096"))
+N_GPU_LAYERS = int(os.getenv("N_GPU_LAYERS", "999"))
+N_THREADS = int(os.getenv("N_THREADS", str(min(16, os.cpu_count() or 8))))
+N_BATCH = int(os.getenv("N_BATCH", "2048"))
+# Weaviate sessions (one gRPC channel each) that concurrent retrievals are spread over
+WEAVIATE_POOL_SIZE = int(os.getenv("WEAVIATE_POOL_SIZE", "4"))
+# Independent Llama contexts answering in parallel; each holds its own copy of the model in (V)RAM
+LLAMA_POOL_SIZE = int(os.getenv("LLAMA_POOL_SIZE", "1"))
+# KV state snapshots kept per Llama context for prompt-prefix reuse (0 disables)
+LLAMA_CACHE_BYTES = int(os.getenv("LLAMA_CACHE_BYTES", str(2 << 30)))
+
+# Opt-in: set to a file (e.g. .cache/semantic_cache.npz) to reuse results of similar questions
+SEMANTIC_CACHE = os.getenv("SEMANTIC_CACHE", "")
+
+# Concurrent questions arriving within EMBED_WAIT_MS share one encode() call
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_WAIT_MS = float(os.getenv("EMBED_WAIT_MS", "5"))
+# Exact repeats of a question reuse their vector (same size as journeyworks_core's LRU)
+EMBED_LRU_SIZE = int(os.getenv("EMBED_LRU_SIZE", "4096"))
+
+
+class EmbedBatcher:
+    """
+    Coalesces question embeddings from concurrent requests into one SentenceTransformer.encode
+    call: the first queued question opens a wait_ms window, up to max_batch questions are
+    collected, sorted by length (less padding) and encoded together off the event loop.
+    Questions seen before are answered from a text-keyed LRU and never queued. The LRU is
+    only touched on the event loop, so it needs no lock.
+    """
+
+    def __init__(self, embedder, max_batch: int = 32, wait_ms: float = 5.0, lru_size: int = 4096):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.wait_ms = wait_ms
+        self.lru_size = lru_size
+        self._lru: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._queue: asyncio.Queue[Tuple[str, asyncio.Future]] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def embed(self, text: str) -> np.ndarray:
+        vec = self._lru.get(text)
+        if vec is not None:
+            self._lru.move_to_end(text)
+            return vec
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.wait_ms / 1000.0
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            batch.sort(key=lambda item: len(item[0]))
+            encode = partial(
+                self.embedder.encode,
+                [text for text, _ in batch],
+                normalize_embeddings=True,
+                batch_size=self.max_batch,
+                show_progress_bar=False,
+            )
+            try:
+                vecs = await loop.run_in_executor(None, encode)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (text, fut), vec in zip(batch, vecs):
+                vec = np.asarray(vec, dtype=np.float32)
+                vec.setflags(write=False)  # shared by every later request for the same text
+                self._remember(text, vec)
+                if not fut.done():  # the request may have been cancelled meanwhile
+                    fut.set_result(vec)
+
+    def _remember(self, text: str, vec: np.ndarray) -> None:
+        self._lru[text] = vec
+        self._lru.move_to_end(text)
+        if len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+
+class WeaviateSessionPool:
+    """
+    Several sessions (each its own client and gRPC channel) to the same Weaviate endpoint, handed
+    out round-robin, so concurrent near_vector calls are not all multiplexed over (and queued
+    behind) a single channel.
+    """
+
+    def __init__(self, factory: Callable[[], WeaviateSession], size: int = 4):
+        self._sessions = [factory() for _ in range(max(1, size))]
+        for session in self._sessions:
+            session.connect()  # a bad endpoint fails at startup
+        self._cycle = itertools.cycle(self._sessions)
+        self._lock = threading.Lock()
+
+    def next_session(self) -> WeaviateSession:
+        with self._lock:
+            return next(self._cycle)
+
+    def close(self) -> None:
+        for session in self._sessions:
+            session.close()
+
+
+class LlamaPool:
+    """
+    Fixed set of Llama contexts created once at startup. A llama.cpp context is not safe to use
+    concurrently, so each request checks one out for the duration of its generation and blocks
+    while all of them are busy.
+    """
+
+    def __init__(self, factory: Callable[[], Llama], size: int = 1):
+        self._all = [factory() for _ in range(max(1, size))]
+        self._free: queue.Queue[Llama] = queue.Queue()
+        for llm in self._all:
+            self._free.put(llm)
+
+    @contextmanager
+    def acquire(self) -> Iterator[Llama]:
+        llm = self._free.get()
+        try:
+            yield llm
+        finally:
+            self._free.put(llm)
+
+    def close(self) -> None:
+        for llm in self._all:
+            llm.close()
+
+
+def _new_llama() -> Llama:
+    llm = Llama(
+        model_path=MISTRAL_GGUF,
+        n_ctx=N_CTX,
+        n_gpu_layers=N_GPU_LAYERS,
+        n_threads=N_THREADS,
+        n_threads_batch=N_THREADS,
+        n_batch=N_BATCH,
+        n_ubatch=min(512, N_BATCH),
+        verbose=False,
+    )
+    if LLAMA_CACHE_BYTES > 0:
+        # restores the saved KV state with the longest common prefix (rules + any overlapping
+        # evidence) before each completion, so only the differing tail is evaluated
+        llm.set_cache(LlamaRAMCache(capacity_bytes=LLAMA_CACHE_BYTES))
+    # Evaluate the fixed rules prefix once. llama.cpp keeps the longest matching token prefix of
+    # the previous prompt in the KV cache, so each request only evaluates question + evidence.
+    llm.eval(llm.tokenize(rag_answer_with_mistral.RAG_PROMPT_PREFIX.encode("utf-8")))
+    return llm
+
+
+_state: Dict[str, Any] = {}
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    _state["embedder"] = get_embedder(EMBED_MODEL, EMBED_BACKEND, ONNX_EMBED_DIR)
+    _state["sessions"] = WeaviateSessionPool(
+        partial(WeaviateSession, WEAVIATE_HOST, WEAVIATE_PORT, WEAVIATE_GRPC_PORT, WEAVIATE_API_KEY),
+        WEAVIATE_POOL_SIZE,
+    )
+    _state["llms"] = LlamaPool(_new_llama, LLAMA_POOL_SIZE)
+    _state["cache"] = SemanticCache(SEMANTIC_CACHE) if SEMANTIC_CACHE else None
+    _state["batcher"] = EmbedBatcher(_state["embedder"], EMBED_MAX_BATCH, EMBED_WAIT_MS, EMBED_LRU_SIZE)
+    _state["batcher"].start()
+    try:
+        yield
+    finally:
+        await _state["batcher"].stop()
+        _state["llms"].close()
+        _state["sessions"].close()
+
+
+app = FastAPI(title="JourneyWorks RAG", lifespan=lifespan)
+
+
+def _session() -> WeaviateSession:
+    return _state["sessions"].next_session()
+
+
+class RetrieveRequest(BaseModel):
+    q: str
+    k: int = 5
+    collection: str = "JourneyWorksTranscript"
+    journey_type: Optional[str] = None
+    outcome: Optional[str] = None
+    sentiment: Optional[str] = None
+    channel: Optional[str] = None
+    show_turns: bool = False
+    snippet_len: int = 400
+
+
+class AskRequest(RetrieveRequest):
+    snippet_len: int = 900
+    require_naturalised_ok: bool = False
+    max_tokens: int = 600
+    temp: float = 0.2
+    top_p: float = 0.95
+
+
+def _retrieve(req: RetrieveRequest, qvec: np.ndarray) -> Dict[str, Any]:
+    hits, cached = query_transcripts.retrieve(
+        _state["embedder"],
+        _session,
+        req.q,
+        req.k,
+        req.collection,
+        embedder_key(EMBED_MODEL, EMBED_BACKEND, ONNX_EMBED_DIR),
+        journey_type=req.journey_type,
+        outcome=req.outcome,
+        sentiment=req.sentiment,
+        channel=req.channel,
+        cache=_state["cache"],
+        qvec=qvec,
+        show_turns=req.show_turns,
+    )
+    # only send as much text as the client will show
+    return {"hits": query_transcripts.trim_hits(hits, req.snippet_len), "cached": cached}
+
+
+def _retrieve_evidence(req: AskRequest, qvec: np.ndarray) -> Tuple[List[Dict[str, Any]], bool]:
+    return rag_answer_with_mistral.retrieve_evidence(
+        _state["embedder"],
+        _session,
+        req.q,
+        req.k,
+        req.collection,
+        embedder_key(EMBED_MODEL, EMBED_BACKEND, ONNX_EMBED_DIR),
+        require_naturalised_ok=req.require_naturalised_ok,
+        journey_type=req.journey_type,
+        outcome=req.outcome,
+        sentiment=req.sentiment,
+        channel=req.channel,
+        cache=_state["cache"],
+        qvec=qvec,
+        snippet_len=req.snippet_len,
+    )
+
+
+def _ask(req: AskRequest, qvec: np.ndarray) -> Dict[str, Any]:
+    evidences, cached = _retrieve_evidence(req, qvec)
+    if not evidences:
+        return {"answer": "", "evidence": [], "cached": cached}
+
+    with _state["llms"].acquire() as llm:
+        answer = rag_answer_with_mistral.answer_question(llm, req.q, evidences, req.max_tokens, req.temp, req.top_p)
+    return {"answer": answer, "evidence": evidences, "cached": cached}
+
+
+class ReactRequest(BaseModel):
+    q: str
+    k: int = 10
+    collection: str = "JourneyWorksTranscript"
+    require_naturalised_ok: bool = False
+    temp: float = 0.2
+    top_p: float = 0.95
+    max_revisions: int = 1
+
+
+def _react_pipeline(req: ReactRequest, llm: Llama) -> react_rag_demo.Pipeline:
+    # wraps the resident models; nothing is loaded or connected per request
+    return react_rag_demo.Pipeline(
+        llm=llm,
+        embedder=_state["embedder"],
+        collection=_session().collection(req.collection),
+        default_k=req.k,
+        default_require_ok=req.require_naturalised_ok,
+        temperature=req.temp,
+        top_p=req.top_p,
+        max_revisions=req.max_revisions,
+        verbose=False,
+    )
+
+
+def _react_plan(req: ReactRequest) -> Dict[str, Any]:
+    with _state["llms"].acquire() as llm:
+        return {"plan": _react_pipeline(req, llm).plan(req.q)}
+
+
+def _react_answer(req: ReactRequest, qvec: np.ndarray) -> Dict[str, Any]:
+    with _state["llms"].acquire() as llm:
+        return _react_pipeline(req, llm).answer(req.q, qvec=qvec)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _sse_answer(req: AskRequest, evidences: List[Dict[str, Any]], cached: bool) -> Iterator[str]:
+    yield _sse("evidence", {"evidence": evidences, "cached": cached})
+    if evidences:
+        # the context stays checked out until the stream ends or the client goes away
+        with _state["llms"].acquire() as llm:
+            for text in rag_answer_with_mistral.stream_answer(
+                llm, req.q, evidences, req.max_tokens, req.temp, req.top_p
+            ):
+                yield _sse("token", {"text": text})
+    yield _sse("done", {})
+
+
+@app.post("/retrieve")
+async def retrieve(req: RetrieveRequest) -> Dict[str, Any]:
+    qvec = await _state["batcher"].embed(req.q)
+    return await run_in_threadpool(_retrieve, req, qvec)
+
+
+@app.post("/ask")
+async def ask(req: AskRequest) -> Dict[str, Any]:
+    qvec = await _state["batcher"].embed(req.q)
+    return await run_in_threadpool(_ask, req, qvec)
+
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest) -> StreamingResponse:
+    """Server-sent events: one `evidence` event, a `token` event per generated piece, then `done`."""
+    qvec = await _state["batcher"].embed(req.q)
+    evidences, cached = await run_in_threadpool(_retrieve_evidence, req, qvec)
+    return StreamingResponse(_sse_answer(req, evidences, cached), media_type="text/event-stream")
+
+
+@app.post("/react/plan")
+async def react_plan(req: ReactRequest) -> Dict[str, Any]:
+    """THINK step of react_rag_demo.py only: the sanitised retrieval plan for the question."""
+    return await run_in_threadpool(_react_plan, req)
+
+
+@app.post("/react/answer")
+async def react_answer(req: ReactRequest) -> Dict[str, Any]:
+    """Full THINK -> ACT -> OBSERVE -> ANSWER loop of react_rag_demo.py on the resident models."""
+    qvec = await _state["batcher"].embed(req.q)
+    return await run_in_threadpool(_react_answer, req, qvec)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("JOURNEYWORKS_HOST", "127.0.0.1"), port=int(os.getenv("JOURNEYWORKS_PORT", "8000")))
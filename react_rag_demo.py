@@ -8,7 +8,7 @@ What it demonstrates
 --------------------
 ReAct loop (controlled, single iteration + optional one revision):
   1) THINK  : Use Mistral to propose a retrieval plan (top_k + metadata filters)
-  2) ACT    : Retrieve evidence from Weaviate (nearVector + filters)
+  2) ACT    : Retrieve evidence from Weaviate (hybrid BM25 + nearVector, with filters)
   3) OBSERVE: Summarise what came back, decide if retrieval is sufficient (optional revise once)
   4) ANSWER : Use Mistral to generate an exec-friendly answer grounded ONLY in retrieved evidence
 
@@ -22,6 +22,7 @@ Assumptions
 Dependencies
 ------------
 pip install -U weaviate-client sentence-transformers llama-cpp-python
+Optional: pip install -U json-repair   (salvages malformed planner / observer JSON)
 
 Example
 -------
@@ -29,183 +30,277 @@ python react_rag_demo.py \
   --q "What are customers disputing about mortgage rate increases, and why does it escalate?" \
   --collection JourneyWorksTranscript \
   --require-naturalised-ok
+
+# many questions on one loaded model ({"q": "..."} per line; JSONL answers)
+python react_rag_demo.py --q-file questions.jsonl --out answers.jsonl
 """
 
 from __future__ import annotations
 
 import argparse
+import asyncio
+import hashlib
 import json
 import os
 import re
 import sys
-from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, FrozenSet, Iterator, List, Optional, Sequence, Set, Tuple
 
-import weaviate
+import numpy as np
 import weaviate.classes as wvc
-from weaviate.classes.init import Auth
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaGrammar
+
+from embedding_cache import EmbeddingCache, embed_with_cache
+from journeyworks_core import clamp, embedder_key, equal_filters, get_embedder, get_session
+from llm_utils import DEFAULT_N_THREADS, load_llm
+from onnx_embedder import DEFAULT_ONNX_MODEL_DIR
 
 
 # ----------------------------
 # Utilities
 # ----------------------------
-def clamp(s: str, n: int) -> str:
-    s = (s or "").strip()
-    if len(s) <= n:
-        return s
-    return s[: n - 1].rstrip() + "…"
+_JSON_RE = re.compile(r"\{.*\}", re.DOTALL)
+_JSON_DECODER = json.JSONDecoder()
 
 
 def extract_json_obj(text: str) -> Optional[Dict[str, Any]]:
     """Best-effort extraction of a JSON object from an LLM response."""
     text = text.strip()
-    m = re.search(r"\{.*\}", text, flags=re.DOTALL)
+
+    # earliest well-formed object; trailing prose or a second fragment doesn't spoil it
+    start = text.find("{")
+    while start != -1:
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(text, start)
+            return obj
+        except ValueError:
+            start = text.find("{", start + 1)
+
+    # nothing parses as is: let json_repair (optional) fix quotes / commas / truncation
+    m = _JSON_RE.search(text)
     if not m:
         return None
     try:
-        return json.loads(m.group(0))
+        from json_repair import repair_json
+    except ImportError:
+        return None
+    try:
+        obj = repair_json(m.group(0), return_objects=True)
     except Exception:
         return None
+    return obj if isinstance(obj, dict) and obj else None
 
 
 # ----------------------------
 # Embeddings (local)
 # ----------------------------
-def get_embedder(model_name: str):
-    try:
-        from sentence_transformers import SentenceTransformer
-    except ImportError as e:
-        raise RuntimeError(
-            "Missing dependency: sentence-transformers. Install with:\n"
-            "  pip install -U sentence-transformers\n"
-        ) from e
-    return SentenceTransformer(model_name)
+def embed_texts(embedder, texts: List[str]) -> np.ndarray:
+    """Encode several queries in one batched forward pass."""
+    vecs = embedder.encode(
+        texts,
+        batch_size=64,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    # float32 rows go to Weaviate as is; no per-component Python floats
+    return vecs.astype(np.float32, copy=False)
 
 
-def embed_text(embedder, text: str) -> List[float]:
-    vec = embedder.encode([text], normalize_embeddings=True, show_progress_bar=False)[0]
-    return vec.tolist()
+def embed_text(embedder, text: str) -> np.ndarray:
+    return embed_texts(embedder, [text])[0]
 
 
 # ----------------------------
-# Weaviate
+# Disk cache (repeat runs of the same question)
 # ----------------------------
-def connect_weaviate(host: str, port: int, grpc_port: int, api_key: Optional[str]):
-    if api_key:
-        client = weaviate.connect_to_local(
-            host=host,
-            port=port,
-            grpc_port=grpc_port,
-            auth_credentials=Auth.api_key(api_key),
-        )
-    else:
-        client = weaviate.connect_to_local(host=host, port=port, grpc_port=grpc_port)
-
-    if not client.is_ready():
-        raise RuntimeError("Weaviate is not ready. Check container + ports.")
-    return client
-
-
-def build_filters(
-    require_naturalised_ok: bool,
-    journey_type: Optional[str],
-    outcome: Optional[str],
-    sentiment: Optional[str],
-    channel: Optional[str],
-) -> Optional[wvc.query.Filter]:
-    clauses: List[wvc.query.Filter] = []
-
-    if require_naturalised_ok:
-        clauses.append(wvc.query.Filter.by_property("naturalised_status").equal("ok"))
-
-    if journey_type:
-        clauses.append(wvc.query.Filter.by_property("journey_type").equal(journey_type))
-    if outcome:
-        clauses.append(wvc.query.Filter.by_property("outcome").equal(outcome))
-    if sentiment:
-        clauses.append(wvc.query.Filter.by_property("sentiment").equal(sentiment))
-    if channel:
-        clauses.append(wvc.query.Filter.by_property("channel").equal(channel))
-
-    if not clauses:
+# Embeddings are deterministic and always cacheable. LLM outputs are only cached for greedy
+# decoding (temperature 0): a sampled completion is one draw, and replaying it would hide
+# the variation the temperature asked for.
+CACHE_DIR = Path(os.getenv("JOURNEYWORKS_CACHE", "~/.cache/journeyworks")).expanduser()
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def open_embedding_cache(model_key: str) -> EmbeddingCache:
+    # same sqlite store the indexing scripts use, in its own file: query-side vectors only
+    return EmbeddingCache(str(CACHE_DIR / "embeddings.sqlite"), model_key)
+
+
+def llm_cache_path(llm: Llama, prompt: str, params: Dict[str, Any], gbnf: Optional[str] = None) -> Path:
+    key = _sha256(prompt + json.dumps({"model": llm.model_path, "grammar": gbnf, **params}, sort_keys=True))
+    return CACHE_DIR / "llm" / f"{key}.json"
+
+
+def read_cached_text(path: Path) -> Optional[str]:
+    if not path.exists():
         return None
+    return json.loads(path.read_text(encoding="utf-8"))["text"]
+
+
+def write_cached_text(path: Path, text: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"text": text}), encoding="utf-8")
+
 
-    f = clauses[0]
-    for c in clauses[1:]:
-        f = f & c
-    return f
+def cached_llm(llm: Llama, prompt: str, params: Dict[str, Any], gbnf: Optional[str] = None) -> str:
+    """Completion text for prompt, reused from disk when the same prompt + params (+ grammar) ran before."""
+    path = llm_cache_path(llm, prompt, params, gbnf)
+    text = read_cached_text(path)
+    if text is None:
+        text = llm(prompt, grammar=compiled_grammar(gbnf) if gbnf else None, **params)["choices"][0]["text"]
+        write_cached_text(path, text)
+    return text
+
+
+# ----------------------------
+# Weaviate
+# ----------------------------
+# Hybrid ranking is precise enough that the planner's top_k range can stay small,
+# which keeps the ANSWER prompt (its prefill dominates latency) short
+TOP_K_MIN, TOP_K_MAX = 5, 15
+HYBRID_ALPHA = 0.6  # 1.0 = pure vector, 0.0 = pure BM25
+
+RETURN_PROPS = [
+    "text",
+    "event_name",
+    "journey_type",
+    "sentiment",
+    "outcome",
+    "channel",
+    "naturalised_status",
+]
+SCORE_METADATA = wvc.query.MetadataQuery(score=True)
+
+
+def clamp_top_k(top_k: int) -> int:
+    return max(TOP_K_MIN, min(TOP_K_MAX, top_k))
 
 
 def retrieve_evidence(
-    client,
-    collection: str,
-    qvec: List[float],
+    col,
+    question: str,
+    qvec: np.ndarray,
     top_k: int,
     where: Optional[wvc.query.Filter],
+    alpha: float = HYBRID_ALPHA,
 ) -> List[Any]:
-    col = client.collections.get(collection)
-    props = [
-        "text",
-        "event_name",
-        "journey_type",
-        "sentiment",
-        "outcome",
-        "channel",
-        "naturalised_status",
-    ]
-    res = col.query.near_vector(
-        near_vector=qvec,
+    """
+    Hybrid (BM25 on the question + our query vector) search on a cached collection handle.
+    Stored vectors come back too: hybrid scores are normalised per query, so the OBSERVE
+    shortcut measures relevance as cosine distance to qvec itself (see vector_distances).
+    """
+    res = col.query.hybrid(
+        query=question,
+        vector=qvec,
+        alpha=alpha,
         limit=top_k,
         filters=where,
-        return_properties=props,
-        return_metadata=wvc.query.MetadataQuery(distance=True),
+        return_properties=RETURN_PROPS,
+        return_metadata=SCORE_METADATA,
+        include_vector=True,
     )
     return res.objects or []
 
 
+def vector_distances(objs: List[Any], qvec: np.ndarray) -> np.ndarray:
+    """Cosine distance from qvec to each object's stored vector."""
+    if not objs:
+        return np.empty(0, dtype=np.float32)
+    vecs = np.asarray(
+        [o.vector.get("default") if isinstance(o.vector, dict) else o.vector for o in objs],
+        dtype=np.float32,
+    )
+    q = np.asarray(qvec, dtype=np.float32)
+    sims = vecs @ q / np.clip(np.linalg.norm(vecs, axis=1) * np.linalg.norm(q), 1e-12, None)
+    return 1.0 - sims
+
+
 # ----------------------------
 # ReAct planning prompts
 # ----------------------------
-def plan_prompt(question: str, allowed: Dict[str, List[str]], default_top_k: int, default_require_ok: bool) -> str:
-    schema = {
-        "top_k": default_top_k,
-        "require_naturalised_ok": default_require_ok,
-        "filters": {
-            "journey_type": None,
-            "outcome": None,
-            "sentiment": None,
-            "channel": None,
-        },
-        "notes": "string",
-    }
-
-    rules = f"""
+# Static instructions come first in every prompt so llama.cpp can reuse their KV state; only the
+# question / plan / evidence tail after them changes between calls.
+PLAN_SCHEMA = {
+    "top_k": "integer",
+    "require_naturalised_ok": "boolean",
+    "filters": {
+        "journey_type": None,
+        "outcome": None,
+        "sentiment": None,
+        "channel": None,
+    },
+    "notes": "one short sentence",
+}
+
+RULES_PLAN = f"""
 You are a retrieval planner for a customer-journey RAG system.
 Your job: propose Weaviate retrieval parameters to find evidence for the USER QUESTION.
 
 Constraints:
-- Output MUST be valid JSON ONLY matching this schema: {json.dumps(schema)}.
+- Output MUST be valid JSON ONLY matching this schema: {json.dumps(PLAN_SCHEMA)}.
 - Choose filter values ONLY from the ALLOWED VALUES lists (or null).
-- top_k must be between 5 and 30.
+- top_k must be between {TOP_K_MIN} and {TOP_K_MAX}.
 - Prefer require_naturalised_ok=true for demo credibility, unless that would likely return too few results.
 - Do NOT answer the question; ONLY plan retrieval.
 """.strip()
 
-    return f"""[INST]
-{rules}
+RULES_OBSERVE = f"""
+Now validate whether the retrieved evidence is sufficient to answer the USER QUESTION above.
+Output MUST be valid JSON ONLY matching the SCHEMA below.
+
+Constraints:
+- revised_top_k must be between {TOP_K_MIN} and {TOP_K_MAX}.
+- revised_filters values must be from the ALLOWED VALUES lists above or null.
+- If evidence is off-topic or too thin, set sufficient=false and revise the plan.
+- Do NOT answer the question.
+""".strip()
+
+RULES_ANSWER = """
+You are assisting a bank executive with insights from customer contact transcripts.
+
+Rules:
+- Answer the QUESTION using ONLY the EVIDENCE provided.
+- If evidence is insufficient, say what is missing and what you would check next.
+- Keep it concise and executive-friendly.
+- Use this structure:
+  1) Key findings (bullets)
+  2) Recommended actions (bullets)
+  3) Evidence references (map each finding/action to [E#])
+- Do NOT invent numbers or facts.
+""".strip()
+
+ANSWER_PROMPT_PREFIX = f"[INST]\n{RULES_ANSWER}\n\n"
 
-USER QUESTION:
+
+@lru_cache(maxsize=8)
+def plan_prompt_prefix(allowed_json: str) -> str:
+    return f"[INST]\n{RULES_PLAN}\n\nALLOWED VALUES:\n{allowed_json}\n\n"
+
+
+def plan_prompt(question: str, allowed_json: str, default_top_k: int, default_require_ok: bool) -> str:
+    defaults = {"top_k": default_top_k, "require_naturalised_ok": default_require_ok}
+    return f"""{plan_prompt_prefix(allowed_json)}USER QUESTION:
 {question}
 
-ALLOWED VALUES:
-{json.dumps(allowed)}
+DEFAULTS (use when the question gives no reason to change them):
+{json.dumps(defaults)}
 
 Return JSON only.
 [/INST]"""
 
 
-def observe_prompt(question: str, plan: Dict[str, Any], evidence_summary: str, allowed: Dict[str, List[str]]) -> str:
+def observe_prompt(plan_turn: str, plan: Dict[str, Any], evidence_summary: str) -> str:
+    """
+    Second turn of the planner conversation: plan_turn is the THINK prompt plus the model's reply,
+    so the question and allowed values are already in context (and in llama.cpp's KV cache).
+    """
     schema = {
         "sufficient": True,
         "revised_top_k": int(plan.get("top_k", 10)),
@@ -215,25 +310,14 @@ def observe_prompt(question: str, plan: Dict[str, Any], evidence_summary: str, a
             "sentiment": plan.get("filters", {}).get("sentiment"),
             "channel": plan.get("filters", {}).get("channel"),
         },
-        "why": "string",
+        "why": "one short sentence",
     }
 
-    rules = f"""
-You are validating whether retrieved evidence is sufficient to answer the question.
-Output MUST be valid JSON ONLY matching this schema: {json.dumps(schema)}.
+    return f"""{plan_turn}</s>[INST]
+{RULES_OBSERVE}
 
-Constraints:
-- revised_top_k must be between 5 and 30.
-- revised_filters values must be from ALLOWED VALUES lists or null.
-- If evidence is off-topic or too thin, set sufficient=false and revise the plan.
-- Do NOT answer the question.
-""".strip()
-
-    return f"""[INST]
-{rules}
-
-USER QUESTION:
-{question}
+SCHEMA:
+{json.dumps(schema)}
 
 PLAN USED:
 {json.dumps(plan)}
@@ -241,41 +325,23 @@ PLAN USED:
 EVIDENCE SUMMARY:
 {evidence_summary}
 
-ALLOWED VALUES:
-{json.dumps(allowed)}
-
 Return JSON only.
 [/INST]"""
 
 
-def answer_prompt(question: str, evidences: List[Dict[str, Any]]) -> str:
-    blocks = []
-    for i, ev in enumerate(evidences, start=1):
-        m = ev["meta"]
-        blocks.append(
-            f"[E{i}] event={m.get('event_name','')} | journey={m.get('journey_type','')} | "
-            f"outcome={m.get('outcome','')} | sentiment={m.get('sentiment','')} | channel={m.get('channel','')}\n"
-            f"{ev['snippet']}"
-        )
+def evidence_block(i: int, ev: Dict[str, Any]) -> str:
+    m = ev["meta"]
+    return (
+        f"[E{i}] event={m.get('event_name','')} | journey={m.get('journey_type','')} | "
+        f"outcome={m.get('outcome','')} | sentiment={m.get('sentiment','')} | channel={m.get('channel','')}\n"
+        f"{ev['snippet']}"
+    )
 
-    rules = """
-You are assisting a bank executive with insights from customer contact transcripts.
 
-Rules:
-- Answer the QUESTION using ONLY the EVIDENCE provided.
-- If evidence is insufficient, say what is missing and what you would check next.
-- Keep it concise and executive-friendly.
-- Use this structure:
-  1) Key findings (bullets)
-  2) Recommended actions (bullets)
-  3) Evidence references (map each finding/action to [E#])
-- Do NOT invent numbers or facts.
-""".strip()
-
-    return f"""[INST]
-{rules}
+def answer_prompt(question: str, evidences: List[Dict[str, Any]]) -> str:
+    blocks = [evidence_block(i, ev) for i, ev in enumerate(evidences, start=1)]
 
-QUESTION:
+    return f"""{ANSWER_PROMPT_PREFIX}QUESTION:
 {question}
 
 EVIDENCE:
@@ -286,26 +352,89 @@ EVIDENCE:
 # ----------------------------
 # Allowed values (simple + safe)
 # ----------------------------
-def get_allowed_values() -> Dict[str, List[str]]:
+def get_allowed_values() -> Dict[str, Tuple[str, ...]]:
     """
     Keep this conservative: values you actually use in your generated spec.
     Edit these lists to match your repo taxonomy.
     """
     return {
-        "journey_type": [
+        "journey_type": (
             "JT_PRICING_DISPUTE",
             "JT_ONBOARDING",
             "JT_CARD_ISSUE",
             "JT_FRAUD",
             "JT_COMPLAINTS",
             "JT_GENERAL_ENQUIRY",
-        ],
-        "outcome": ["resolved", "escalated", "abandoned"],
-        "sentiment": ["negative", "neutral", "positive"],
-        "channel": ["phone", "chat", "email", "twitter"],
+        ),
+        "outcome": ("resolved", "escalated", "abandoned"),
+        "sentiment": ("negative", "neutral", "positive"),
+        "channel": ("phone", "chat", "email", "twitter"),
     }
 
 
+# Built once: sets for O(1) validation, JSON for the prompts
+ALLOWED_VALUES = get_allowed_values()
+ALLOWED_SETS = {k: frozenset(v) for k, v in ALLOWED_VALUES.items()}
+ALLOWED_JSON = json.dumps(ALLOWED_VALUES)
+
+
+# ----------------------------
+# Output grammars (GBNF)
+# ----------------------------
+FILTER_KEYS = ("journey_type", "outcome", "sentiment", "channel")
+
+
+def _gbnf_literal(s: str) -> str:
+    return '"' + s.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _gbnf_object(fields: List[Tuple[str, str]]) -> str:
+    members = ' ws "," ws '.join(f"{_gbnf_literal(json.dumps(key))} ws \":\" ws {rule}" for key, rule in fields)
+    return f'"{{" ws {members} ws "}}"'
+
+
+def _gbnf_common_rules(allowed: Dict[str, Sequence[str]]) -> List[str]:
+    # GBNF rule names can't contain underscores
+    rules = [f"filters ::= {_gbnf_object([(key, key.replace('_', '-')) for key in FILTER_KEYS])}"]
+    for key in FILTER_KEYS:
+        values = ['"null"'] + [_gbnf_literal(json.dumps(v)) for v in allowed.get(key, [])]
+        rules.append(f"{key.replace('_', '-')} ::= {' | '.join(values)}")
+    return rules + [
+        f"topk ::= {' | '.join(_gbnf_literal(str(k)) for k in range(TOP_K_MIN, TOP_K_MAX + 1))}",
+        'bool ::= "true" | "false"',
+        'string ::= "\\"" ( [^"\\\\\\x00-\\x1f] | "\\\\" ( ["\\\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] ) )* "\\""',
+        "ws ::= [ \\t\\n]?",
+    ]
+
+
+def build_plan_grammar(allowed: Dict[str, Sequence[str]]) -> str:
+    """GBNF for the THINK schema: top_k in TOP_K_MIN..TOP_K_MAX and filter values restricted to allowed (or null)."""
+    root = _gbnf_object(
+        [("top_k", "topk"), ("require_naturalised_ok", "bool"), ("filters", "filters"), ("notes", "string")]
+    )
+    return "\n".join([f"root ::= {root}", *_gbnf_common_rules(allowed)])
+
+
+def build_observe_grammar(allowed: Dict[str, Sequence[str]]) -> str:
+    """GBNF for the OBSERVE schema, with the same bounds on the revised plan."""
+    root = _gbnf_object(
+        [("sufficient", "bool"), ("revised_top_k", "topk"), ("revised_filters", "filters"), ("why", "string")]
+    )
+    return "\n".join([f"root ::= {root}", *_gbnf_common_rules(allowed)])
+
+
+@lru_cache(maxsize=8)
+def allowed_grammars(allowed_json: str) -> Tuple[str, str]:
+    """(plan, observe) GBNF for a JSON-serialised allowed-values dict, built once per distinct dict."""
+    allowed = json.loads(allowed_json)
+    return build_plan_grammar(allowed), build_observe_grammar(allowed)
+
+
+@lru_cache(maxsize=16)
+def compiled_grammar(gbnf: str) -> LlamaGrammar:
+    return LlamaGrammar.from_string(gbnf, verbose=False)
+
+
 # ----------------------------
 # Main demo
 # ----------------------------
@@ -323,30 +452,443 @@ def summarise_results(objs: List[Any], max_items: int = 5) -> str:
     return "\n".join(lines)
 
 
-def objs_to_evidence(objs: List[Any], max_evidence: int = 10) -> List[Dict[str, Any]]:
+EVIDENCE_META_KEYS = ("event_name", "journey_type", "sentiment", "outcome", "channel", "naturalised_status")
+
+
+# OBSERVE shortcut thresholds (cosine distance; MiniLM neighbours of a good match sit well under 0.5)
+OBSERVE_MIN_RESULTS = 3
+OBSERVE_GOOD_BEST_DIST = 0.35
+OBSERVE_GOOD_WORST_DIST = 0.6
+
+
+def quick_observe(objs: List[Any], plan: Dict[str, Any], qvec: np.ndarray) -> Optional[Dict[str, Any]]:
+    """
+    OBSERVE verdict for retrievals that are clearly good or clearly too thin, shaped like the
+    LLM's JSON; None when it's a judgement call and the LLM should decide.
+    """
+    top_k = int(plan["top_k"])
+    filters = plan.get("filters") or {}
+    if len(objs) < OBSERVE_MIN_RESULTS:
+        # widen: more results and without the most selective filter
+        return {
+            "sufficient": False,
+            "revised_top_k": top_k * 2,
+            "revised_filters": {**filters, "journey_type": None},
+            "why": f"only {len(objs)} results; widening the search",
+        }
+    if len(objs) >= max(TOP_K_MIN, top_k * 0.6):
+        dists = vector_distances(objs, qvec)
+        if dists.min() < OBSERVE_GOOD_BEST_DIST and dists.max() < OBSERVE_GOOD_WORST_DIST:
+            return {"sufficient": True, "why": "enough close matches"}
+    return None
+
+
+ANSWER_MAX_TOKENS = 650
+MIN_SNIPPET_CHARS = 200  # a budget-shortened snippet below this isn't worth including
+
+
+def objs_to_evidence(
+    objs: List[Any],
+    max_evidence: int = 10,
+    budget_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Evidence dicts for distinct objects, skipping repeats by uuid and by the first 200 chars of
+    text (chunked transcripts often come back near-duplicated). With budget_tokens and
+    count_tokens, [E#] blocks are packed in rank order until the budget is spent; the block that
+    overflows it is shortened to fit.
+    """
     evidences: List[Dict[str, Any]] = []
-    for obj in objs[:max_evidence]:
+    seen_uuids: Set[str] = set()
+    seen_prefixes: Set[bytes] = set()
+    used = 0
+    for obj in objs:
+        if len(evidences) >= max_evidence:
+            break
         pr = obj.properties or {}
-        evidences.append(
-            {
-                "meta": {
-                    "event_name": pr.get("event_name", ""),
-                    "journey_type": pr.get("journey_type", ""),
-                    "sentiment": pr.get("sentiment", ""),
-                    "outcome": pr.get("outcome", ""),
-                    "channel": pr.get("channel", ""),
-                    "naturalised_status": pr.get("naturalised_status", ""),
-                    "uuid": str(obj.uuid),
-                },
-                "snippet": clamp(pr.get("text", ""), 900),
+        text = pr.get("text") or ""
+        uuid = str(obj.uuid)
+        prefix = hashlib.blake2b(text[:200].encode("utf-8"), digest_size=8).digest()
+        if uuid in seen_uuids or prefix in seen_prefixes:
+            continue
+        seen_uuids.add(uuid)
+        seen_prefixes.add(prefix)
+
+        meta = {k: pr.get(k, "") for k in EVIDENCE_META_KEYS}
+        meta["uuid"] = uuid
+        ev = {"meta": meta, "snippet": clamp(text, 900)}
+
+        if budget_tokens is not None and count_tokens is not None:
+            cost = count_tokens(evidence_block(len(evidences) + 1, ev))
+            remaining = budget_tokens - used
+            if cost > remaining:
+                keep = len(ev["snippet"]) * max(remaining, 0) // cost
+                if keep >= MIN_SNIPPET_CHARS:
+                    ev["snippet"] = clamp(ev["snippet"], keep)
+                    evidences.append(ev)
+                break
+            used += cost
+        evidences.append(ev)
+    return evidences
+
+
+def plan_key(plan: Dict[str, Any]) -> Tuple[Any, ...]:
+    """What a retrieval depends on; plans with equal keys fetch the same objects."""
+    filters = plan.get("filters") or {}
+    return (
+        int(plan["top_k"]),
+        bool(plan.get("require_naturalised_ok")),
+        tuple(sorted((k, v) for k, v in filters.items() if v is not None)),
+    )
+
+
+def sanitise_filters(filters: Dict[str, Any], allowed_sets: Dict[str, FrozenSet[str]]) -> Dict[str, Any]:
+    for key in FILTER_KEYS:
+        v = filters.get(key, None)
+        if v is not None and v not in allowed_sets.get(key, ()):
+            filters[key] = None
+    return filters
+
+
+@dataclass
+class Pipeline:
+    """
+    The loaded pieces of the ReAct loop (Mistral, embedder, Weaviate collection) plus its settings.
+    Build it once and call answer() per question: nothing is reloaded between questions, and
+    llama.cpp reuses the KV cache for whatever prompt prefix the next call shares.
+    """
+
+    llm: Llama
+    embedder: Any
+    collection: Any  # handle from the process-wide Weaviate session, reused for every retrieval
+    default_k: int = 10
+    default_require_ok: bool = False
+    temperature: float = 0.2
+    top_p: float = 0.95
+    max_revisions: int = 1
+    alpha: float = HYBRID_ALPHA
+    verbose: bool = True
+    # query vectors reused across runs (keyed by embedder_key); None re-embeds every time
+    embed_cache: Optional[EmbeddingCache] = None
+    # reuse completions from CACHE_DIR; only honoured when temperature == 0 (see llm_cache_on)
+    disk_cache: bool = False
+    allowed: Dict[str, Sequence[str]] = field(default_factory=lambda: ALLOWED_VALUES)
+    allowed_sets: Dict[str, FrozenSet[str]] = field(init=False, repr=False)
+    allowed_json: str = field(init=False, repr=False)
+    plan_gbnf: str = field(init=False, repr=False)
+    observe_gbnf: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # rag_server builds a Pipeline per request; the default taxonomy costs nothing to attach
+        if self.allowed is ALLOWED_VALUES:
+            self.allowed_sets, self.allowed_json = ALLOWED_SETS, ALLOWED_JSON
+        else:
+            self.allowed_sets = {k: frozenset(v) for k, v in self.allowed.items()}
+            self.allowed_json = json.dumps(self.allowed)
+        self.plan_gbnf, self.observe_gbnf = allowed_grammars(self.allowed_json)
+
+    def log(self, *parts: Any) -> None:
+        if self.verbose:
+            print(*parts)
+
+    def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        if self.embed_cache is None:
+            return list(embed_texts(self.embedder, texts))
+        vecs = embed_with_cache(texts, lambda missing: embed_texts(self.embedder, missing), self.embed_cache)
+        return [np.asarray(v, dtype=np.float32) for v in vecs]
+
+    def embed(self, text: str) -> np.ndarray:
+        if self.embed_cache is None:
+            return embed_text(self.embedder, text)
+        return self.embed_many([text])[0]
+
+    @property
+    def llm_cache_on(self) -> bool:
+        return self.disk_cache and self.temperature == 0
+
+    def sampling_params(self, max_tokens: int) -> Dict[str, Any]:
+        return {
+            "max_tokens": max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stop": ["</s>", "[INST]"],
+        }
+
+    def complete(self, prompt: str, max_tokens: int, gbnf: Optional[str] = None) -> str:
+        params = self.sampling_params(max_tokens)
+        if self.llm_cache_on:
+            return cached_llm(self.llm, prompt, params, gbnf).strip()
+        grammar = compiled_grammar(gbnf) if gbnf else None
+        return self.llm(prompt, grammar=grammar, **params)["choices"][0]["text"].strip()
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def stream(self, prompt: str, max_tokens: int) -> Iterator[str]:
+        """Like complete, but yields the text piece by piece as it is decoded."""
+        params = self.sampling_params(max_tokens)
+        path = llm_cache_path(self.llm, prompt, params) if self.llm_cache_on else None
+        cached = read_cached_text(path) if path is not None else None
+        if cached is not None:
+            yield cached.strip()
+            return
+
+        pieces: List[str] = []
+        for chunk in self.llm(prompt, stream=True, **params):
+            text = chunk["choices"][0]["text"]
+            if not pieces:
+                text = text.lstrip()
+                if not text:
+                    continue
+            pieces.append(text)
+            yield text
+        if path is not None:
+            write_cached_text(path, "".join(pieces))
+
+    # ------------------------
+    # THINK: create retrieval plan
+    # ------------------------
+    def think(self, question: str) -> Tuple[Dict[str, Any], str]:
+        """Sanitised plan, plus the planner turn (prompt + reply) that OBSERVE continues from."""
+        self.log("\n=== THINK (plan retrieval) ===")
+        ptxt = plan_prompt(question, self.allowed_json, self.default_k, self.default_require_ok)
+        # grammar-bound JSON is ~60 tokens plus the notes sentence
+        pout = self.complete(ptxt, 120, self.plan_gbnf)
+
+        plan = extract_json_obj(pout)
+        if plan is None:
+            plan = {
+                "top_k": self.default_k,
+                "require_naturalised_ok": self.default_require_ok,
+                "filters": {"journey_type": None, "outcome": None, "sentiment": None, "channel": None},
+                "notes": "planner JSON parse failed; using defaults",
             }
+
+        # Sanitise plan
+        top_k = int(plan.get("top_k") or self.default_k)
+        top_k = clamp_top_k(top_k)
+        plan["top_k"] = top_k
+
+        req_ok = bool(plan.get("require_naturalised_ok", self.default_require_ok))
+        plan["require_naturalised_ok"] = req_ok
+
+        plan["filters"] = sanitise_filters(plan.get("filters") or {}, self.allowed_sets)
+
+        self.log(json.dumps(plan, indent=2))
+        return plan, ptxt + pout
+
+    def plan(self, question: str) -> Dict[str, Any]:
+        return self.think(question)[0]
+
+    # ------------------------
+    # ACT: retrieve evidence
+    # ------------------------
+    def retrieve(self, question: str, qvec: np.ndarray, plan: Dict[str, Any]) -> List[Any]:
+        f = plan.get("filters") or {}
+        where = equal_filters(
+            (
+                ("naturalised_status", "ok" if plan.get("require_naturalised_ok") else None),
+                *((key, f.get(key)) for key in FILTER_KEYS),
+            )
         )
-    return evidences
+        return retrieve_evidence(self.collection, question, qvec, int(plan["top_k"]), where, self.alpha)
+
+    def answer(
+        self,
+        question: str,
+        qvec: Optional[np.ndarray] = None,
+        thought: Optional[Tuple[Dict[str, Any], str]] = None,
+        objs: Optional[List[Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run THINK -> ACT -> OBSERVE (at most max_revisions) -> ANSWER for one question.
+        The embedding, THINK result and first ACT result can be passed in when already computed.
+        """
+        if qvec is None:
+            qvec = self.embed(question)
+        plan, plan_turn = thought if thought is not None else self.think(question)
+
+        self.log("\n=== ACT (retrieve) ===")
+        if objs is None:
+            objs = self.retrieve(question, qvec, plan)
+        self.log(f"Retrieved: {len(objs)} objects (requested top_k={plan['top_k']})")
+
+        # ------------------------
+        # OBSERVE: decide if sufficient; allow ONE revision
+        # ------------------------
+        revisions = 0
+        while revisions < self.max_revisions:
+            obs = quick_observe(objs, plan, qvec)
+            if obs is not None:
+                # clear-cut either way: no LLM call needed
+                self.log("\n=== OBSERVE (heuristic) ===")
+                self.log(obs["why"])
+            else:
+                summary = summarise_results(objs, max_items=5)
+                self.log("\n=== OBSERVE (judge retrieval) ===")
+                self.log(summary)
 
+                oout = self.complete(observe_prompt(plan_turn, plan, summary), 120, self.observe_gbnf)
+                obs = extract_json_obj(oout)
+            if not obs:
+                # If parse fails, assume sufficient to avoid looping
+                break
+
+            sufficient = bool(obs.get("sufficient", True))
+            if sufficient:
+                break
+
+            # Apply revised plan once
+            revised_top_k = int(obs.get("revised_top_k") or plan["top_k"])
+            revised_top_k = clamp_top_k(revised_top_k)
+
+            # sanitise revised filters
+            revised_filters = sanitise_filters(obs.get("revised_filters") or plan.get("filters") or {}, self.allowed_sets)
+
+            revised = {
+                "top_k": revised_top_k,
+                "require_naturalised_ok": plan.get("require_naturalised_ok", True),
+                "filters": revised_filters,
+                "notes": f"revised: {obs.get('why','')}",
+            }
+            if plan_key(revised) == plan_key(plan):
+                # same search again would return the same evidence
+                self.log("\n(revised plan is unchanged; keeping current evidence)")
+                break
+            plan = revised
+
+            revisions += 1
+            self.log("\n--- REVISED PLAN ---")
+            self.log(json.dumps(plan, indent=2))
+
+            self.log("\n=== ACT (retrieve, revised) ===")
+            seen = {str(o.uuid) for o in objs}
+            objs = self.retrieve(question, qvec, plan)
+            self.log(f"Retrieved: {len(objs)} objects (requested top_k={plan['top_k']})")
+            if {str(o.uuid) for o in objs} <= seen:
+                # nothing new came back, so another OBSERVE round can't change its verdict
+                break
+
+        # ------------------------
+        # ANSWER: grounded response from evidence
+        # ------------------------
+        # whatever n_ctx leaves after the fixed prompt and the answer's own tokens
+        budget = self.llm.n_ctx() - ANSWER_MAX_TOKENS - self.count_tokens(answer_prompt(question, []))
+        evidences = objs_to_evidence(objs, int(plan["top_k"]), budget, self.count_tokens)
+        self.log("\n=== ANSWER (grounded) ===")
+        pieces: List[str] = []
+        for text in self.stream(answer_prompt(question, evidences), ANSWER_MAX_TOKENS):
+            if self.verbose:
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            pieces.append(text)
+        self.log()
+        ans = "".join(pieces).strip()
+
+        return {"plan": plan, "revisions": revisions, "answer": ans, "evidence": evidences}
+
+    async def answer_async(self, question: str) -> Dict[str, Any]:
+        # embedding and THINK are independent until ACT, so they run side by side
+        qvec, thought = await asyncio.gather(
+            asyncio.to_thread(self.embed, question),
+            asyncio.to_thread(self.think, question),
+        )
+        return await asyncio.to_thread(self.answer, question, qvec, thought)
+
+    def answer_batch(self, questions: List[str], workers: int = 8) -> List[Dict[str, Any]]:
+        """
+        Answer many questions on the already-loaded models: one batched encode() for all of
+        them, then every THINK back to back on the warm Llama, then all first retrievals in
+        parallel (gRPC calls release the GIL). OBSERVE / ANSWER follow per question.
+        """
+        qvecs = self.embed_many(questions)
+        thoughts = [self.think(q) for q in questions]
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            first_objs = list(ex.map(lambda i: self.retrieve(questions[i], qvecs[i], thoughts[i][0]), range(len(questions))))
+        return [
+            self.answer(q, qvec, thought, objs)
+            for q, qvec, thought, objs in zip(questions, qvecs, thoughts, first_objs)
+        ]
+
+    def close(self) -> None:
+        # llama-cpp can be noisy with ResourceWarnings; safe to close.
+        self.llm.close()
+        if self.embed_cache is not None:
+            self.embed_cache.close()
+
+
+def open_collection(args: argparse.Namespace):
+    # one gRPC connection per process, closed at exit (see journeyworks_core.get_session)
+    return get_session(args.host, args.port, args.grpc_port, args.api_key).collection(args.collection)
+
+
+def load_llm_from_args(args: argparse.Namespace, warm_prefix: str = "") -> Llama:
+    # warm_prefix is prefilled while the embedder and Weaviate are still loading
+    return load_llm(
+        args.mistral_model,
+        n_ctx=args.n_ctx,
+        n_batch=args.n_batch,
+        n_threads=args.n_threads,
+        n_gpu_layers=args.n_gpu_layers,
+        use_mlock=args.mlock,
+        warm_prefix=warm_prefix,
+    )
 
-def main():
+
+async def build_pipeline_async(args: argparse.Namespace) -> Pipeline:
+    # Embedder load, Weaviate connect and GGUF load don't depend on each other; overlap them
+    embedder, collection, llm = await asyncio.gather(
+        asyncio.to_thread(get_embedder, args.embed_model, args.embed_backend, args.onnx_dir),
+        asyncio.to_thread(open_collection, args),
+        asyncio.to_thread(load_llm_from_args, args, plan_prompt_prefix(ALLOWED_JSON)),
+        return_exceptions=True,
+    )
+    errors = [r for r in (embedder, collection, llm) if isinstance(r, BaseException)]
+    if errors:
+        if not isinstance(llm, BaseException):
+            llm.close()
+        raise errors[0]
+
+    return Pipeline(
+        llm=llm,
+        embedder=embedder,
+        collection=collection,
+        default_k=args.k,
+        default_require_ok=bool(args.require_naturalised_ok),
+        temperature=args.temp,
+        top_p=args.top_p,
+        max_revisions=args.max_revisions,
+        alpha=args.alpha,
+        # ONNX/int8 vectors differ slightly from torch ones; embedder_key keeps their entries apart
+        embed_cache=None if args.no_cache else open_embedding_cache(embedder_key(args.embed_model, args.embed_backend, args.onnx_dir)),
+        disk_cache=not args.no_cache,
+    )
+
+
+def build_pipeline(args: argparse.Namespace) -> Pipeline:
+    return asyncio.run(build_pipeline_async(args))
+
+
+def print_evidence_debug(evidences: List[Dict[str, Any]]) -> None:
+    # For debugging / UI integration
+    print("\n=== EVIDENCE (debug) ===")
+    for i, ev in enumerate(evidences[:5], start=1):
+        m = ev["meta"]
+        print(
+            f"[E{i}] uuid={m['uuid']} naturalised={m['naturalised_status']} "
+            f"event={m['event_name']} journey={m['journey_type']} "
+            f"outcome={m['outcome']} sentiment={m['sentiment']}"
+        )
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
     ap = argparse.ArgumentParser()
-    ap.add_argument("--q", required=True, help="User question")
+    qs = ap.add_mutually_exclusive_group(required=True)
+    qs.add_argument("--q", help="User question")
+    qs.add_argument("--q-file", help='JSONL of questions ({"q": "..."} per line), answered as one batch')
+    ap.add_argument("--out", help="With --q-file: write JSONL results here instead of stdout")
+    ap.add_argument("--workers", type=int, default=8, help="With --q-file: parallel Weaviate retrievals")
     ap.add_argument("--collection", default="JourneyWorksTranscript")
     ap.add_argument("--k", type=int, default=10, help="Default top_k if planner fails")
     ap.add_argument("--require-naturalised-ok", action="store_true", help="Default require_naturalised_ok if planner fails")
@@ -357,185 +899,71 @@ def main():
     ap.add_argument("--grpc-port", type=int, default=int(os.getenv("WEAVIATE_GRPC_PORT", "50051")))
     ap.add_argument("--api-key", default=os.getenv("WEAVIATE_API_KEY"))
 
+    ap.add_argument("--alpha", type=float, default=HYBRID_ALPHA, help="Hybrid search weight (1=vector, 0=BM25)")
+
     # Embeddings
     ap.add_argument("--embed-model", default=os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"))
+    ap.add_argument("--embed-backend", choices=["torch", "onnx"], default=os.getenv("EMBED_BACKEND", "torch"))
+    ap.add_argument("--onnx-dir", default=os.getenv("ONNX_EMBED_DIR", DEFAULT_ONNX_MODEL_DIR), help="ONNX export used by --embed-backend onnx")
 
     # Mistral / llama.cpp
-    ap.add_argument("--mistral-model", default=os.getenv("MISTRAL_GGUF", "models/mistral-7b-instruct-v0.2.Q5_K_M.gguf"))
+    ap.add_argument("--mistral-model", default=os.getenv("MISTRAL_GGUF", "models/mistral-7b-instruct-v0.2.Q4_K_M.gguf"))
     ap.add_argument("--n-ctx", type=int, default=4096)
     ap.add_argument("--n-gpu-layers", type=int, default=999)
+    ap.add_argument("--n-threads", type=int, default=DEFAULT_N_THREADS)
+    ap.add_argument("--n-batch", type=int, default=2048, help="Prompt tokens per llama_decode call (prefill)")
+    ap.add_argument("--mlock", action="store_true", help="Lock the model in RAM (needs enough free memory)")
     ap.add_argument("--temp", type=float, default=0.2)
     ap.add_argument("--top-p", type=float, default=0.95)
 
     # Safety: single revision at most
     ap.add_argument("--max-revisions", type=int, default=1)
 
-    args = ap.parse_args()
+    # Repeat runs reuse embeddings (and, at --temp 0, LLM outputs) from JOURNEYWORKS_CACHE
+    # (default ~/.cache/journeyworks)
+    ap.add_argument("--no-cache", action="store_true", help="Always re-embed and re-run the LLM")
+    return ap
 
-    # 0) Prepare embedder
-    embedder = get_embedder(args.embed_model)
-    qvec = embed_text(embedder, args.q)
 
-    # 1) Connect Weaviate
-    client = connect_weaviate(args.host, args.port, args.grpc_port, args.api_key)
-    try:
-        if not client.collections.exists(args.collection):
-            raise RuntimeError(f"Collection '{args.collection}' does not exist. Run index_transcripts.py first.")
+def read_questions(path: str) -> List[str]:
+    questions: List[str] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                questions.append(json.loads(line)["q"])
+    return questions
 
-        allowed = get_allowed_values()
-
-        # 2) Load LLM once
-        llm = Llama(
-            model_path=args.mistral_model,
-            n_ctx=args.n_ctx,
-            n_gpu_layers=args.n_gpu_layers,
-            verbose=False,
-        )
 
-        try:
-            # ------------------------
-            # THINK: create retrieval plan
-            # ------------------------
-            print("\n=== THINK (plan retrieval) ===")
-            ptxt = plan_prompt(args.q, allowed, args.k, bool(args.require_naturalised_ok))
-            pout = llm(
-                ptxt,
-                max_tokens=320,
-                temperature=args.temp,
-                top_p=args.top_p,
-                stop=["</s>", "[INST]"],
-            )["choices"][0]["text"].strip()
-
-            plan = extract_json_obj(pout)
-            if plan is None:
-                plan = {
-                    "top_k": args.k,
-                    "require_naturalised_ok": bool(args.require_naturalised_ok),
-                    "filters": {"journey_type": None, "outcome": None, "sentiment": None, "channel": None},
-                    "notes": "planner JSON parse failed; using defaults",
-                }
-
-            # Sanitise plan
-            top_k = int(plan.get("top_k") or args.k)
-            top_k = max(5, min(30, top_k))
-            plan["top_k"] = top_k
-
-            req_ok = bool(plan.get("require_naturalised_ok", bool(args.require_naturalised_ok)))
-            plan["require_naturalised_ok"] = req_ok
-
-            filters = plan.get("filters") or {}
-            for key in ["journey_type", "outcome", "sentiment", "channel"]:
-                v = filters.get(key, None)
-                if v is not None and v not in allowed.get(key, []):
-                    filters[key] = None
-            plan["filters"] = filters
-
-            print(json.dumps(plan, indent=2))
-
-            # ------------------------
-            # ACT: retrieve evidence
-            # ------------------------
-            def run(plan_dict: Dict[str, Any]) -> List[Any]:
-                f = plan_dict.get("filters") or {}
-                where = build_filters(
-                    require_naturalised_ok=bool(plan_dict.get("require_naturalised_ok")),
-                    journey_type=f.get("journey_type"),
-                    outcome=f.get("outcome"),
-                    sentiment=f.get("sentiment"),
-                    channel=f.get("channel"),
-                )
-                return retrieve_evidence(client, args.collection, qvec, int(plan_dict["top_k"]), where)
-
-            print("\n=== ACT (retrieve) ===")
-            objs = run(plan)
-            print(f"Retrieved: {len(objs)} objects (requested top_k={plan['top_k']})")
-
-            # ------------------------
-            # OBSERVE: decide if sufficient; allow ONE revision
-            # ------------------------
-            revisions = 0
-            while revisions < args.max_revisions:
-                summary = summarise_results(objs, max_items=5)
-                print("\n=== OBSERVE (judge retrieval) ===")
-                print(summary)
-
-                otxt = observe_prompt(args.q, plan, summary, allowed)
-                oout = llm(
-                    otxt,
-                    max_tokens=260,
-                    temperature=args.temp,
-                    top_p=args.top_p,
-                    stop=["</s>", "[INST]"],
-                )["choices"][0]["text"].strip()
+def write_results(results: List[Dict[str, Any]], out: Optional[str]) -> None:
+    f = open(out, "w", encoding="utf-8") if out else sys.stdout
+    try:
+        for r in results:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    finally:
+        if out:
+            f.close()
 
-                obs = extract_json_obj(oout)
-                if not obs:
-                    # If parse fails, assume sufficient to avoid looping
-                    break
-
-                sufficient = bool(obs.get("sufficient", True))
-                if sufficient:
-                    break
-
-                # Apply revised plan once
-                revised_top_k = int(obs.get("revised_top_k") or plan["top_k"])
-                revised_top_k = max(5, min(30, revised_top_k))
-
-                revised_filters = obs.get("revised_filters") or plan.get("filters") or {}
-                # sanitise revised filters
-                for key in ["journey_type", "outcome", "sentiment", "channel"]:
-                    v = revised_filters.get(key, None)
-                    if v is not None and v not in allowed.get(key, []):
-                        revised_filters[key] = None
-
-                plan = {
-                    "top_k": revised_top_k,
-                    "require_naturalised_ok": plan.get("require_naturalised_ok", True),
-                    "filters": revised_filters,
-                    "notes": f"revised: {obs.get('why','')}",
-                }
-
-                revisions += 1
-                print("\n--- REVISED PLAN ---")
-                print(json.dumps(plan, indent=2))
-
-                print("\n=== ACT (retrieve, revised) ===")
-                objs = run(plan)
-                print(f"Retrieved: {len(objs)} objects (requested top_k={plan['top_k']})")
-
-            # ------------------------
-            # ANSWER: grounded response from evidence
-            # ------------------------
-            evidences = objs_to_evidence(objs, max_evidence=int(plan["top_k"]))
-            print("\n=== ANSWER (grounded) ===")
-            atxt = answer_prompt(args.q, evidences)
-            ans = llm(
-                atxt,
-                max_tokens=650,
-                temperature=args.temp,
-                top_p=args.top_p,
-                stop=["</s>", "[INST]"],
-            )["choices"][0]["text"].strip()
-
-            print(ans)
-
-            # For debugging / UI integration
-            print("\n=== EVIDENCE (debug) ===")
-            for i, ev in enumerate(evidences[:5], start=1):
-                m = ev["meta"]
-                print(
-                    f"[E{i}] uuid={m['uuid']} naturalised={m['naturalised_status']} "
-                    f"event={m['event_name']} journey={m['journey_type']} "
-                    f"outcome={m['outcome']} sentiment={m['sentiment']}"
-                )
-
-        finally:
-            # llama-cpp can be noisy with ResourceWarnings; safe to close.
-            llm.close()
 
+async def run(args: argparse.Namespace) -> None:
+    pipeline = await build_pipeline_async(args)
+    try:
+        if args.q_file:
+            questions = read_questions(args.q_file)
+            pipeline.verbose = False  # results go out as JSONL
+            results = await asyncio.to_thread(pipeline.answer_batch, questions, args.workers)
+            write_results([{"q": q, **r} for q, r in zip(questions, results)], args.out)
+        else:
+            result = await pipeline.answer_async(args.q)
+            print_evidence_debug(result["evidence"])
     finally:
-        client.close()
+        pipeline.close()
+
+
+def main():
+    args = build_arg_parser().parse_args()
+    asyncio.run(run(args))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
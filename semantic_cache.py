@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import os
+import threading
+import zipfile
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import orjson
+
+
+DEFAULT_SEMANTIC_CACHE_PATH = ".cache/semantic_cache.npz"
+
+
+def to_hits(objects) -> List[Dict[str, Any]]:
+    """Plain, JSON-serialisable copy of Weaviate result objects (the payload the cache stores)."""
+    hits: List[Dict[str, Any]] = []
+    for obj in objects or []:
+        md = obj.metadata
+        hits.append(
+            {
+                "uuid": str(obj.uuid),
+                "distance": getattr(md, "distance", None) if md is not None else None,
+                "properties": dict(obj.properties or {}),
+            }
+        )
+    return hits
+
+
+def _quantize(v: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Symmetric per-vector int8 quantisation: v ~= codes * scale."""
+    peak = float(np.abs(v).max()) if v.size else 0.0
+    scale = peak / 127.0 if peak > 0 else 1.0
+    return np.round(v / scale).astype(np.int8), scale
+
+
+def _best_match_numpy(codes: np.ndarray, scales: np.ndarray, q_codes: np.ndarray, q_scale: float, threshold: float) -> int:
+    sims = (codes @ q_codes.astype(np.int32)) * scales * q_scale
+    i = int(sims.argmax())
+    return i if sims[i] >= threshold else -1
+
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional: plain NumPy is used without it
+    best_match = _best_match_numpy
+else:
+
+    @njit(cache=True, parallel=True, fastmath=True)
+    def best_match(codes: np.ndarray, scales: np.ndarray, q_codes: np.ndarray, q_scale: float, threshold: float) -> int:
+        """
+        Index of the centroid most similar to the query if it reaches threshold, else -1.
+        Inputs are int8 codes of unit-norm vectors, so the rescaled int32 dot is the cosine.
+        """
+        n, dim = codes.shape
+        sims = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.int32(0)
+            for j in range(dim):
+                acc += np.int32(codes[i, j]) * np.int32(q_codes[j])
+            sims[i] = acc * scales[i] * q_scale
+        # serial argmax: a shared running best inside prange would race
+        best = -1
+        best_s = -np.inf
+        for i in range(n):
+            if sims[i] > best_s:
+                best_s = sims[i]
+                best = i
+        return best if best_s >= threshold else -1
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    return v / norm if norm > 0 else v
+
+
+class _Scope:
+    # centroids are held as int8 codes with one float32 scale per row (~4x smaller than float32);
+    # origins are the (fixed) embeddings of the questions whose hits are the payloads
+    __slots__ = ("codes", "scales", "origin_codes", "origin_scales", "counts", "payloads")
+
+    def __init__(self, dim: int):
+        self.codes = np.empty((0, dim), dtype=np.int8)
+        self.scales = np.empty(0, dtype=np.float32)
+        self.origin_codes = np.empty((0, dim), dtype=np.int8)
+        self.origin_scales = np.empty(0, dtype=np.float32)
+        self.counts: List[int] = []
+        self.payloads: List[Any] = []
+
+    @property
+    def dim(self) -> int:
+        return self.codes.shape[1]
+
+    def centroid(self, i: int) -> np.ndarray:
+        return self.codes[i].astype(np.float32) * self.scales[i]
+
+    def set_centroid(self, i: int, v: np.ndarray) -> None:
+        self.codes[i], self.scales[i] = _quantize(v)
+
+    def set_origin(self, i: int, v: np.ndarray) -> None:
+        self.origin_codes[i], self.origin_scales[i] = _quantize(v)
+
+    def origin_similarity(self, i: int, q_codes: np.ndarray, q_scale: float) -> float:
+        return float(self.origin_codes[i].astype(np.int32) @ q_codes.astype(np.int32)) * float(self.origin_scales[i]) * q_scale
+
+
+class SemanticCache:
+    """
+    Retrieval cache keyed by query embedding rather than query text.
+    Past questions are clustered online: each cluster keeps a unit-norm centroid, a member
+    count and the hits of the question that created it (its origin). A question whose embedding
+    has cosine similarity >= threshold with both the closest centroid and that cluster's origin
+    reuses the cluster's hits (skipping the Weaviate round trip) and is folded into the centroid,
+    so near-duplicate phrasings share one row. Checking the origin too stops a centroid that has
+    drifted with its members from serving hits to questions far from the one they answer.
+    Entries are grouped by scope (collection, k, filters, embed model...), so only queries
+    with the same shape can match. When a scope reaches `capacity` clusters, its two most
+    similar centroids are merged to make room. Centroids are stored as per-row int8 codes;
+    the quantisation error (~1e-3 in cosine) is far below the similarity threshold.
+    Persisted as a single .npz so separate CLI runs share it.
+    Safe to share between threads (rag_server.py retrieves concurrently).
+    """
+
+    def __init__(self, path: Optional[str] = DEFAULT_SEMANTIC_CACHE_PATH, capacity: int = 1024, threshold: float = 0.86):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self._scopes: Dict[str, _Scope] = {}
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def lookup(self, scope: str, qvec: Sequence[float]) -> Optional[Any]:
+        with self._lock:
+            s = self._scopes.get(scope)
+            if s is None or not s.payloads:
+                return None
+            q = _unit(qvec)
+            if q.shape[0] != s.dim:
+                return None
+
+            q_codes, q_scale = _quantize(q)
+            i = best_match(s.codes, s.scales, q_codes, q_scale, self.threshold)
+            if i < 0 or s.origin_similarity(i, q_codes, q_scale) < self.threshold:
+                return None
+
+            # running mean of the cluster's members, renormalised
+            n = s.counts[i]
+            s.set_centroid(i, _unit(s.centroid(i) * n + q))
+            s.counts[i] = n + 1
+            return s.payloads[i]
+
+    def insert(self, scope: str, qvec: Sequence[float], payload: Any) -> None:
+        with self._lock:
+            q = _unit(qvec)
+            s = self._scopes.get(scope)
+            if s is None or s.dim != q.shape[0]:
+                s = self._scopes[scope] = _Scope(q.shape[0])
+
+            if len(s.payloads) >= self.capacity:
+                i = self._merge_closest(s)
+                s.set_centroid(i, q)
+                s.set_origin(i, q)
+                s.counts[i] = 1
+                s.payloads[i] = payload
+            else:
+                codes, scale = _quantize(q)
+                s.codes = np.vstack([s.codes, codes[None, :]])
+                s.scales = np.append(s.scales, np.float32(scale))
+                s.origin_codes = np.vstack([s.origin_codes, codes[None, :]])
+                s.origin_scales = np.append(s.origin_scales, np.float32(scale))
+                s.counts.append(1)
+                s.payloads.append(payload)
+
+    @staticmethod
+    def _merge_closest(s: _Scope) -> int:
+        """Merge the two most similar centroids into one and return the freed slot."""
+        if len(s.payloads) < 2:
+            return 0
+        centroids = s.codes.astype(np.float32) * s.scales[:, None]
+        sims = centroids @ centroids.T
+        np.fill_diagonal(sims, -np.inf)
+        i, j = np.unravel_index(int(sims.argmax()), sims.shape)
+        i, j = int(i), int(j)
+        # keep the more popular cluster's hits, with the origin they were retrieved for, so
+        # lookups still test questions against that origin and not only the merged centroid
+        if s.counts[j] > s.counts[i]:
+            i, j = j, i
+
+        ni, nj = s.counts[i], s.counts[j]
+        s.set_centroid(i, _unit(centroids[i] * ni + centroids[j] * nj))
+        s.counts[i] = ni + nj
+        return j
+
+    def save(self) -> None:
+        with self._lock:
+            if not self.path:
+                return
+            parent = os.path.dirname(self.path)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+
+            names = list(self._scopes)
+            meta = {
+                "scopes": [
+                    {
+                        "scope": name,
+                        "counts": self._scopes[name].counts,
+                        "payloads": self._scopes[name].payloads,
+                    }
+                    for name in names
+                ],
+            }
+            arrays: Dict[str, np.ndarray] = {}
+            for i, name in enumerate(names):
+                arrays[f"c{i}"] = self._scopes[name].codes
+                arrays[f"s{i}"] = self._scopes[name].scales
+                arrays[f"o{i}"] = self._scopes[name].origin_codes
+                arrays[f"os{i}"] = self._scopes[name].origin_scales
+            arrays["meta"] = np.frombuffer(orjson.dumps(meta), dtype=np.uint8)
+
+            # write-then-rename so an interrupted save never leaves a truncated cache behind
+            tmp = self.path + ".tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp, self.path)
+
+    def _load(self) -> None:
+        try:
+            with np.load(self.path) as z:
+                meta = orjson.loads(z["meta"].tobytes())
+                for i, entry in enumerate(meta["scopes"]):
+                    s = _Scope(z[f"c{i}"].shape[1])
+                    s.codes = z[f"c{i}"]
+                    s.scales = z[f"s{i}"]
+                    s.origin_codes = z[f"o{i}"]
+                    s.origin_scales = z[f"os{i}"]
+                    s.counts = entry["counts"]
+                    s.payloads = entry["payloads"]
+                    self._scopes[entry["scope"]] = s
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile, orjson.JSONDecodeError):
+            # unreadable/old cache (e.g. saved before origins were kept): start empty, it is rebuilt as queries come in
+            self._scopes = {}
@@ -1,18 +1,18 @@
+import sys
+
 from sentence_transformers import SentenceTransformer
-from llama_cpp import Llama
+
+from llm_utils import load_llm
 
 llm = None
 try:
-    llm = Llama(
-        model_path="models/mistral-7b-instruct-v0.2.Q5_K_M.gguf",
-        n_ctx=2048,
-        n_batch=64,
-        verbose=False,
-    )
+    llm = load_llm("models/mistral-7b-instruct-v0.2.Q4_K_M.gguf")
 
-    out = llm("[INST] Say hello in one sentence. [/INST]", max_tokens=50, stop=["</s>", "[INST]"])
-    print(out["choices"][0]["text"])
+    for chunk in llm("[INST] Say hello in one sentence. [/INST]", max_tokens=50, stop=["</s>", "[INST]"], stream=True):
+        sys.stdout.write(chunk["choices"][0]["text"])
+        sys.stdout.flush()
+    print()
 
 finally:
     if llm is not None:
-        llm.close()
\ No newline at end of file
+        llm.close()